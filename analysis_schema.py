@@ -0,0 +1,156 @@
+import json
+import re
+from typing import Dict, List, Optional
+
+
+SAFETY_RATINGS = ['Safe', 'Caution', 'Unsafe']
+
+FINDING_SECTIONS = [
+    ('allergen_risk', 'Allergen Risk'),
+    ('dietary_compliance', 'Dietary Compliance'),
+    ('nutritional_impact', 'Nutritional Impact'),
+    ('health_considerations', 'Health Considerations'),
+]
+
+_STRING_LIST = {'type': 'array', 'items': {'type': 'string'}}
+
+# The API emits properties in alphabetical order, so the key names are chosen
+# to put the short allergen list and the assessment (rating before summary)
+# ahead of the longer findings and recommendations when streaming.
+ANALYSIS_RESPONSE_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'allergens': _STRING_LIST,
+        'assessment': {
+            'type': 'object',
+            'properties': {
+                'rating': {'type': 'string', 'format': 'enum', 'enum': SAFETY_RATINGS},
+                'summary': {'type': 'string'},
+            },
+            'required': ['rating', 'summary'],
+        },
+        'findings': {
+            'type': 'object',
+            'properties': {key: _STRING_LIST for key, _ in FINDING_SECTIONS},
+            'required': [key for key, _ in FINDING_SECTIONS],
+        },
+        'recommendations': _STRING_LIST,
+    },
+    'required': ['allergens', 'assessment', 'findings', 'recommendations'],
+}
+
+ANALYSIS_GENERATION_CONFIG = {
+    'response_mime_type': 'application/json',
+    'response_schema': ANALYSIS_RESPONSE_SCHEMA,
+}
+
+_PARTIAL_RATING = re.compile(r'"rating"\s*:\s*"(\w+)"')
+_PARTIAL_SUMMARY = re.compile(r'"summary"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_PARTIAL_ITEM = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)"')
+
+
+def _string_list(value) -> List[str]:
+    if not isinstance(value, list):
+        return []
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def parse_analysis(text: str) -> Dict:
+    """
+    Parse the model's JSON reply into a typed analysis dict:
+    ``{'rating', 'summary', 'allergens', 'findings': {section: [..]}, 'recommendations'}``.
+    Missing or malformed fields become empty values; an unexpected rating becomes "Unknown".
+    """
+    data = json.loads(text)
+    assessment = data.get('assessment') or {}
+    findings = data.get('findings') or {}
+    rating = assessment.get('rating')
+    return {
+        'rating': rating if rating in SAFETY_RATINGS else 'Unknown',
+        'summary': str(assessment.get('summary') or '').strip(),
+        'allergens': _string_list(data.get('allergens')),
+        'findings': {key: _string_list(findings.get(key)) for key, _ in FINDING_SECTIONS},
+        'recommendations': _string_list(data.get('recommendations')),
+    }
+
+
+def analysis_to_reply(analysis: Dict) -> str:
+    """Serialize a typed analysis back into the reply format parse_analysis reads"""
+    return json.dumps({
+        'allergens': analysis['allergens'],
+        'assessment': {'rating': analysis['rating'], 'summary': analysis['summary']},
+        'findings': analysis['findings'],
+        'recommendations': analysis['recommendations'],
+    })
+
+
+def partial_rating(text: str) -> Optional[str]:
+    """The safety rating from a partially received JSON reply, once it has arrived"""
+    match = _PARTIAL_RATING.search(text)
+    if match and match.group(1) in SAFETY_RATINGS:
+        return match.group(1)
+    return None
+
+
+def partial_summary(text: str) -> Optional[str]:
+    """The assessment summary from a partially received JSON reply, once it is complete"""
+    match = _PARTIAL_SUMMARY.search(text)
+    if match is None:
+        return None
+    return json.loads(f'"{match.group(1)}"')
+
+
+def _partial_list(text: str, key: str) -> List[str]:
+    start = re.search(r'"' + key + r'"\s*:\s*\[', text)
+    if start is None:
+        return []
+    items, position = [], start.end()
+    while True:
+        match = _PARTIAL_ITEM.match(text, position)
+        if match is None:
+            return items
+        items.append(json.loads(f'"{match.group(1)}"'))
+        position = match.end()
+
+
+def partial_lists(text: str) -> Dict:
+    """
+    The allergens, findings and recommendations from a partially received
+    JSON reply: every list item whose string has been received in full
+    """
+    return {
+        'allergens': _partial_list(text, 'allergens'),
+        'findings': {key: _partial_list(text, key) for key, _ in FINDING_SECTIONS},
+        'recommendations': _partial_list(text, 'recommendations'),
+    }
+
+
+def render_analysis_markdown(analysis) -> str:
+    """
+    Markdown for the results page. Accepts a typed analysis dict, or the
+    free-text analysis stored by older history entries.
+    """
+    if not isinstance(analysis, dict):
+        return analysis or ''
+
+    lines = [
+        "### SAFETY ASSESSMENT",
+        f"**{analysis.get('rating', 'Unknown')}** — {analysis.get('summary', '')}",
+        "",
+    ]
+    if analysis.get('allergens'):
+        lines += [f"**Allergens present:** {', '.join(analysis['allergens'])}", ""]
+
+    lines.append("### FURTHER ANALYSIS")
+    findings = analysis.get('findings') or {}
+    for key, title in FINDING_SECTIONS:
+        if findings.get(key):
+            lines.append(f"#### {title}")
+            lines += [f"- {finding}" for finding in findings[key]]
+            lines.append("")
+
+    if analysis.get('recommendations'):
+        lines.append("### RECOMMENDATIONS")
+        lines += [f"- {recommendation}" for recommendation in analysis['recommendations']]
+
+    return "\n".join(lines).strip()
@@ -4,122 +4,259 @@ import yaml
 from yaml.loader import SafeLoader
 from yaml.dumper import SafeDumper
 import os
-import json
-
-import boto3
-
-
-s3_client=boto3.client(
-    's3',
-    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-    region_name=os.getenv('AWS_REGION'),
-    verify=True,
-    use_ssl=True,
-    config=boto3.session.Config(
-        signature_version='s3v4',
-        retries={'max_attempts':3},
-    )
-)
+import copy
+import random
+import threading
+import time
 
-aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
-aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-aws_region = os.getenv('AWS_REGION', 'us-east-2')
-s3_bucket = os.getenv('S3_BUCKET', 'nutriscan-ai-users-jane')
+from profile_cache import ProfileCache
+from storage import get_storage, NotModified, PreconditionFailed
 
 
-# Print debug info
-print(f"DEBUG - AWS Access Key: {aws_access_key[:5]}... Secret Key: {'*' * 5} Region: {aws_region} Bucket: {s3_bucket}")
+S3_USERS_KEY = 'users/credentials.json'
+S3_PROFILES_KEY = 'users/profiles.json'  # legacy: all users in one object
+S3_PROFILES_PREFIX = 'users/profiles/'
 
-# Check for missing credentials
-if not aws_access_key or not aws_secret_key:
-    print("ERROR - AWS credentials are missing!")
+# In-process cache of per-user profile objects, revalidated against storage by ETag
+profile_cache = ProfileCache(
+    max_entries=int(os.getenv('PROFILE_CACHE_MAX_ENTRIES', '256')),
+    ttl_seconds=float(os.getenv('PROFILE_CACHE_TTL_SECONDS', '30')),
+)
 
+# Users known not to be in the legacy profiles.json, so reads of users without
+# a per-user object do not download the whole legacy file every time
+_legacy_absent = set()
+_legacy_absent_lock = threading.Lock()
 
-S3_BUCKET = os.getenv('S3_BUCKET')
-S3_USERS_KEY = 'users/credentials.json'
-S3_PROFILES_KEY = 'users/profiles.json'
+# Conditional (If-Match) profile writes: attempts before giving up, and counters
+PROFILE_WRITE_MAX_ATTEMPTS = int(os.getenv('PROFILE_WRITE_MAX_ATTEMPTS', '5'))
+_profile_write_stats = {'writes': 0, 'conflicts': 0, 'retries': 0, 'failures': 0}
+_profile_write_stats_lock = threading.Lock()
 
 def get_users_from_s3() -> dict:
     """
-    Retrieve user credential data from S3
+    Retrieve user credential data from the storage backend
     """
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=S3_USERS_KEY)
-        users_data = json.loads(response['Body'].read().decode('utf-8'))
-        return users_data
-    except s3_client.exceptions.NoSuchKey:
-        print(f"No credentials found in S3, will create new credentials file")
-        return {}
+        stored = get_storage().get(S3_USERS_KEY)
+        if stored is None:
+            print(f"No credentials found in storage, will create new credentials file")
+            return {}
+        return stored.data
     except Exception as e:
-        print(f"An error occurred while fetching user data from S3: {str(e)}")
+        print(f"An error occurred while fetching user data from storage: {str(e)}")
         return {}
 
 def save_users_to_s3(users_data: dict) -> bool:
     """
-    Save user credential data to S3
+    Save user credential data to the storage backend
     """
     try:
-        users_json = json.dumps(users_data)
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=S3_USERS_KEY,
-            Body=users_json
-        )
-        print("User credentials successfully saved to S3")
+        get_storage().put(S3_USERS_KEY, users_data)
+        print("User credentials successfully saved to storage")
         return True
     except Exception as e:
-        print(f"An error occurred while saving to S3: {str(e)}")
+        print(f"An error occurred while saving to storage: {str(e)}")
         return False
 
 def get_user_profiles_from_s3() -> dict:
     """
-    Retrieve user profile data from S3
+    Retrieve the legacy shared user profile data
     """
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=S3_PROFILES_KEY)
-        profiles_data = json.loads(response['Body'].read().decode('utf-8'))
-        return profiles_data
-    except s3_client.exceptions.NoSuchKey:
-        st.info(f"No profiles found in S3, creating new profiles file")
-        return {}
+        stored = get_storage().get(S3_PROFILES_KEY)
+        if stored is None:
+            st.info(f"No profiles found in storage, creating new profiles file")
+            return {}
+        return stored.data
     except Exception as e:
-        st.error(f"An error occurred while fetching profile data from S3: {str(e)}")
+        st.error(f"An error occurred while fetching profile data from storage: {str(e)}")
         return {}
 
 def save_user_profiles_to_s3(profiles_data: dict) -> bool:
     """
-    Save user profile data to S3
+    Save the legacy shared user profile data
     """
     try:
-        profiles_json = json.dumps(profiles_data)
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=S3_PROFILES_KEY,
-            Body=profiles_json
-        )
+        get_storage().put(S3_PROFILES_KEY, profiles_data)
         return True
     except Exception as e:
-        st.error(f"An error occurred while saving profiles to S3: {str(e)}")
+        st.error(f"An error occurred while saving profiles to storage: {str(e)}")
         return False
+    finally:
+        with _legacy_absent_lock:
+            _legacy_absent.difference_update(profiles_data)
+        for username in profiles_data:
+            profile_cache.invalidate(username)
 
-# Helper functions to work with specific user profiles
-def save_user_profile(username: str, profile_data: dict) -> bool:
+def _profile_key(username: str) -> str:
     """
-    Save a specific user's profile data
+    Storage key of the per-user profile object
+    """
+    return f"{S3_PROFILES_PREFIX}{username}.json"
+
+def _fetch_user_profile(username: str, use_cache: bool = True) -> tuple[dict, str | None]:
+    """
+    Fetch a user's profile object and its ETag from storage.
+
+    Reads go through ``profile_cache``: fresh entries are returned without a
+    request, stale ones are revalidated with If-None-Match so an unchanged
+    profile costs a 304 instead of a full download. The ETag is None when the
+    per-user object does not exist yet; in that case the profile comes from
+    the legacy shared profiles.json, if the user is in it. A user missing from
+    both is cached as an empty profile, and is never looked up in the legacy
+    file again.
+    """
+    cached = profile_cache.get(username) if use_cache else None
+    if cached is not None and profile_cache.is_fresh(cached):
+        return copy.deepcopy(cached.data), cached.etag
+
+    try:
+        stored = get_storage().get(_profile_key(username), if_none_match=cached.etag if cached else None)
+    except NotModified:
+        profile_cache.touch(username)
+        return copy.deepcopy(cached.data), cached.etag
+
+    if stored is None:
+        legacy_profile = _get_legacy_user_profile(username)
+        if legacy_profile is None:
+            profile_cache.put(username, {}, None)
+            return {}, None
+        profile_cache.invalidate(username)
+        return legacy_profile, None
+    profile_cache.put(username, stored.data, stored.etag)
+    return stored.data, stored.etag
+
+def get_user_profile_from_s3(username: str) -> dict:
+    """
+    Retrieve a single user's profile object from storage.
+
+    Users that have not been written since the move to per-user objects are
+    read once from the legacy shared profiles.json and copied to their own key,
+    even when their profile there is empty.
     """
     try:
-        profiles = get_user_profiles_from_s3()
-        # st.write(f"Debug - Current profiles: {profiles}")
+        profile_data, etag = _fetch_user_profile(username)
+        if etag is None and not _is_legacy_absent(username):
+            save_user_profile_to_s3(username, profile_data)
+        return profile_data
+    except Exception as e:
+        st.error(f"An error occurred while fetching profile data from storage: {str(e)}")
+        return {}
 
-        profiles[username] = profile_data
-        # st.write(f"Debug - Saving profile for {username}: {profile_data}")
+def save_user_profile_to_s3(username: str, profile_data: dict) -> bool:
+    """
+    Save a single user's profile object to storage, unconditionally
+    """
+    try:
+        get_storage().put(_profile_key(username), profile_data)
+        return True
+    except Exception as e:
+        st.error(f"An error occurred while saving profiles to storage: {str(e)}")
+        return False
+    finally:
+        profile_cache.invalidate(username)
 
-        result = save_user_profiles_to_s3(profiles)
-        # st.write(f"Debug - Save result: {result}")
+def update_user_profile(username: str, mutate, max_attempts: int = PROFILE_WRITE_MAX_ATTEMPTS,
+                        report_errors: bool = True) -> bool:
+    """
+    Apply ``mutate`` to a user's profile and save it with optimistic concurrency.
 
-        return result
+    ``mutate`` receives the current profile dict and changes it in place. The
+    write is conditional (If-Match on the ETag that was read, or
+    If-None-Match: * when creating the object). If another writer got there
+    first, the profile is re-read, ``mutate`` is applied again to the new
+    version and the write is retried, so concurrent updates are merged instead
+    of overwriting each other.
 
+    Pass ``report_errors=False`` when calling from a background thread, where
+    st.error has no script to render into; errors are only logged then.
+    """
+    for attempt in range(max_attempts):
+        if attempt:
+            _record_profile_write('retries')
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        try:
+            profile_data, etag = _fetch_user_profile(username, use_cache=attempt == 0)
+            mutate(profile_data)
+
+            new_etag = get_storage().put(
+                _profile_key(username),
+                profile_data,
+                if_match=etag,
+                if_none_match=etag is None,
+            )
+            profile_cache.put(username, profile_data, new_etag)
+            _record_profile_write('writes')
+            return True
+        except PreconditionFailed:
+            profile_cache.invalidate(username)
+            _record_profile_write('conflicts')
+        except Exception as e:
+            profile_cache.invalidate(username)
+            if report_errors:
+                st.error(f"An error occurred while saving profiles to storage: {str(e)}")
+            else:
+                print(f"DEBUG - Error saving profile of {username} to storage: {str(e)}")
+            break
+
+    _record_profile_write('failures')
+    return False
+
+def get_profile_write_stats() -> dict:
+    """
+    Counters for conditional profile writes: successful writes, ETag conflicts,
+    retries and writes that gave up
+    """
+    with _profile_write_stats_lock:
+        return dict(_profile_write_stats)
+
+def _record_profile_write(counter: str) -> None:
+    with _profile_write_stats_lock:
+        _profile_write_stats[counter] += 1
+
+def _is_legacy_absent(username: str) -> bool:
+    with _legacy_absent_lock:
+        return username in _legacy_absent
+
+def _get_legacy_user_profile(username: str):
+    """
+    Look up a user in the legacy shared profiles.json, if it still exists.
+    Returns None if the user is not in it; that answer is remembered.
+    """
+    if _is_legacy_absent(username):
+        return None
+    # Errors propagate: an empty answer would be copied over the user's legacy profile
+    stored = get_storage().get(S3_PROFILES_KEY)
+    if stored is None or username not in stored.data:
+        with _legacy_absent_lock:
+            _legacy_absent.add(username)
+        return None
+    return stored.data[username]
+
+def replace_profile_fields(profile_data: dict):
+    """
+    Return a mutation that replaces the stored profile fields with ``profile_data``.
+
+    The stored product history is kept as is: it is owned by the history
+    helpers, and the copy held in the session may be older than what is in S3.
+    """
+    def apply_profile(stored_profile: dict) -> None:
+        product_history = stored_profile.get('product_history')
+        stored_profile.clear()
+        stored_profile.update(copy.deepcopy(profile_data))
+        if product_history is not None:
+            stored_profile['product_history'] = product_history
+
+    return apply_profile
+
+# Helper functions to work with specific user profiles
+def save_user_profile(username: str, profile_data: dict) -> bool:
+    """
+    Save a specific user's profile data
+    """
+    try:
+        return update_user_profile(username, replace_profile_fields(profile_data))
     except Exception as e:
         st.error(f"Failed to save user profile: {str(e)}")
         return False
@@ -129,8 +266,7 @@ def get_user_profile(username: str) -> dict:
     Get a specific user's profile data
     """
     try:
-        profiles = get_user_profiles_from_s3()
-        return profiles.get(username, {})
+        return get_user_profile_from_s3(username)
     except Exception as e:
         st.error(f"Failed to get user profile: {str(e)}")
         return {}
@@ -250,9 +386,6 @@ def render_auth_ui():
                 users = config['credentials']['usernames']
 
                 if username in users and users[username]['password'] == password:
-                    user_profile = get_user_profile(username)
-                    # st.write(f"Debug - Loading user profile: {user_profile}")
-
                     st.session_state['authenticated'] = True
                     st.session_state['username'] = username
                     st.session_state['step'] = 'welcome'
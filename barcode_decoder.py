@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from pyzbar.pyzbar import ZBarSymbol, decode
+
+
+# Only retail product codes are looked up, so zbar skips every other symbology
+RETAIL_SYMBOLS = [ZBarSymbol.EAN13, ZBarSymbol.EAN8, ZBarSymbol.UPCA, ZBarSymbol.UPCE]
+
+# Longest side of the image used for the cheap first pass and region detection
+BARCODE_FAST_MAX_SIDE = int(os.getenv('BARCODE_FAST_MAX_SIDE', '1024'))
+# Longest side used for the sharpened retry
+BARCODE_SHARPEN_MAX_SIDE = int(os.getenv('BARCODE_SHARPEN_MAX_SIDE', '2048'))
+BARCODE_MAX_REGIONS = int(os.getenv('BARCODE_MAX_REGIONS', '4'))
+# Regions tried when looking for every barcode in a shelf or cart photo
+BARCODE_SHELF_MAX_REGIONS = int(os.getenv('BARCODE_SHELF_MAX_REGIONS', '24'))
+# Threads running decode variants, and how long a scan may take overall
+BARCODE_DECODE_WORKERS = int(os.getenv('BARCODE_DECODE_WORKERS', str(min(8, os.cpu_count() or 2))))
+BARCODE_DECODE_DEADLINE_SECONDS = float(os.getenv('BARCODE_DECODE_DEADLINE_SECONDS', '1.5'))
+
+DecodeAttempt = Tuple[str, Callable[[], List[str]]]
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def downscale(gray: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    """Resize so the longest side is at most ``max_side``; returns (image, scale factor applied)"""
+    scale = max_side / max(gray.shape[:2])
+    if scale >= 1:
+        return gray, 1.0
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+_decode_pool: Optional[ThreadPoolExecutor] = None
+_decode_pool_lock = threading.Lock()
+
+
+def _get_decode_pool() -> ThreadPoolExecutor:
+    global _decode_pool
+    if _decode_pool is None:
+        with _decode_pool_lock:
+            if _decode_pool is None:
+                _decode_pool = ThreadPoolExecutor(max_workers=BARCODE_DECODE_WORKERS, thread_name_prefix='barcode-decode')
+    return _decode_pool
+
+
+def is_valid_gtin(value: str) -> bool:
+    """Check the length and GS1 check digit of an EAN/UPC code"""
+    if not value.isdigit() or len(value) not in (8, 12, 13):
+        return False
+    digits = [int(d) for d in value]
+    total = sum(d * (3 if i % 2 else 1) for i, d in enumerate(reversed(digits[:-1]), start=1))
+    return (10 - total % 10) % 10 == digits[-1]
+
+
+def decode_retail(gray: np.ndarray) -> List[str]:
+    """
+    Decode the retail barcodes in ``gray``, in reading order without
+    duplicates or invalid check digits. UPC-A codes are returned in their
+    13-digit EAN form, as zbar reports them with its default configuration.
+    UPC-E codes are returned as zbar reports them (8 digits).
+    """
+    values = []
+    for symbol in decode(gray, symbols=RETAIL_SYMBOLS):
+        value = symbol.data.decode('ascii', errors='ignore')
+        if symbol.type == 'UPCA' and len(value) == 12:
+            value = '0' + value
+        if symbol.type != 'UPCE' and not is_valid_gtin(value):
+            continue
+        if value and value not in values:
+            values.append(value)
+    return values
+
+
+def find_barcode_regions(gray: np.ndarray, max_regions: int = BARCODE_MAX_REGIONS) -> List[Tuple]:
+    """
+    Candidate barcode locations as rotated rectangles ``((cx, cy), (w, h), angle)``,
+    largest first. Bars show up as areas with strong gradient across one axis
+    and little along the other; those areas are blurred and closed into
+    blobs. Both bar orientations are searched.
+    """
+    grad_x = cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=-1))
+    grad_y = cv2.convertScaleAbs(cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=-1))
+    min_area = gray.shape[0] * gray.shape[1] * 0.002
+
+    regions = []
+    for gradient, kernel_size in ((cv2.subtract(grad_x, grad_y), (21, 7)), (cv2.subtract(grad_y, grad_x), (7, 21))):
+        blurred = cv2.blur(gradient, (9, 9))
+        _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size))
+        closed = cv2.dilate(cv2.erode(closed, None, iterations=4), None, iterations=4)
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        regions += [cv2.minAreaRect(contour) for contour in contours if cv2.contourArea(contour) >= min_area]
+
+    regions.sort(key=lambda rect: rect[1][0] * rect[1][1], reverse=True)
+    return regions[:max_regions]
+
+
+def crop_region(gray: np.ndarray, rect: Tuple, scale: float, margin: float = 0.25) -> np.ndarray:
+    """
+    Crop a region found on an image downscaled by ``scale`` from the
+    full-resolution ``gray``, with a margin to keep the quiet zone
+    """
+    (cx, cy), (w, h), _ = rect
+    half_w = w * (0.5 + margin) / scale
+    half_h = h * (0.5 + margin) / scale
+    cx, cy = cx / scale, cy / scale
+    radius = max(half_w, half_h)
+    x0, y0 = max(0, int(cx - radius)), max(0, int(cy - radius))
+    x1, y1 = min(gray.shape[1], int(cx + radius)), min(gray.shape[0], int(cy + radius))
+    return gray[y0:y1, x0:x1]
+
+
+def deskew(crop: np.ndarray, angle: float) -> np.ndarray:
+    """Rotate a crop around its center so a rectangle at ``angle`` becomes axis-aligned"""
+    h, w = crop.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(crop, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def sharpen(gray: np.ndarray) -> np.ndarray:
+    """Unsharp mask, for slightly blurred bars"""
+    blurred = cv2.GaussianBlur(gray, (0, 0), 3)
+    return cv2.addWeighted(gray, 1.5, blurred, -0.5, 0)
+
+
+def adaptive_threshold(gray: np.ndarray) -> np.ndarray:
+    """Binarize against the local mean, for uneven lighting and glare"""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+
+
+def equalize(gray: np.ndarray) -> np.ndarray:
+    """CLAHE contrast equalization, for low-contrast or faded prints"""
+    return cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+
+
+def rotate(gray: np.ndarray, angle: float) -> np.ndarray:
+    """Rotate by ``angle`` degrees, enlarging the canvas so nothing is cut off"""
+    h, w = gray.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_w, new_h = int(h * sin + w * cos), int(h * cos + w * sin)
+    matrix[0, 2] += new_w / 2 - w / 2
+    matrix[1, 2] += new_h / 2 - h / 2
+    return cv2.warpAffine(gray, matrix, (new_w, new_h), borderMode=cv2.BORDER_REPLICATE)
+
+
+def iter_decode_attempts(image: np.ndarray, max_regions: int = BARCODE_MAX_REGIONS) -> Iterator[DecodeAttempt]:
+    """
+    Decode attempts for ``image``, cheapest first, as (name, attempt) pairs.
+    Each attempt returns the barcodes it found. Work shared between attempts
+    (grayscale conversion, downscaling, region detection) is done lazily, as
+    the attempts are consumed.
+
+    1. the downscaled image, which finds most well-framed codes
+    2. full-resolution crops of up to ``max_regions`` detected barcode
+       regions, as-is and deskewed, for small or tilted codes
+    3. the full-resolution image, and preprocessed variants: sharpened,
+       adaptive threshold, CLAHE, inverted polarity and rotations
+    """
+    gray = to_gray(image)
+    small, scale = downscale(gray, BARCODE_FAST_MAX_SIDE)
+    yield 'downscaled', lambda: decode_retail(small)
+
+    for i, rect in enumerate(find_barcode_regions(small, max_regions)):
+        crop = crop_region(gray, rect, scale)
+        if crop.size == 0:
+            continue
+        yield f'region-{i}', lambda crop=crop: decode_retail(crop)
+        angle = rect[2]
+        if 5 < abs(angle) < 85:
+            yield f'region-{i}-deskewed', lambda crop=crop, angle=angle: decode_retail(deskew(crop, angle))
+
+    if scale < 1:
+        yield 'full-resolution', lambda: decode_retail(gray)
+    yield 'sharpened', lambda: decode_retail(sharpen(downscale(gray, BARCODE_SHARPEN_MAX_SIDE)[0]))
+    yield 'adaptive-threshold', lambda: decode_retail(adaptive_threshold(small))
+    yield 'clahe', lambda: decode_retail(equalize(small))
+    yield 'inverted', lambda: decode_retail(cv2.bitwise_not(small))
+    for angle in (30, -30, 60, -60):
+        yield f'rotated-{angle}', lambda angle=angle: decode_retail(rotate(small, angle))
+
+
+def confirm_barcodes(image: np.ndarray, barcodes: List[str]) -> bool:
+    """
+    Whether the cheap downscaled pass over ``image`` finds barcodes, all of
+    them among ``barcodes``: confirms a result cached for a similar picture
+    """
+    found = decode_retail(downscale(to_gray(image), BARCODE_FAST_MAX_SIDE)[0])
+    return bool(found) and set(found) <= set(barcodes)
+
+
+def decode_first(image: np.ndarray) -> List[str]:
+    """Run the decode attempts in order and return the barcodes found by the first that succeeds"""
+    for _, attempt in iter_decode_attempts(image):
+        barcodes = attempt()
+        if barcodes:
+            return barcodes
+    return []
+
+
+def decode_parallel(image: np.ndarray, deadline: float = BARCODE_DECODE_DEADLINE_SECONDS) -> List[str]:
+    """
+    Like decode_first, but only the cheap downscaled pass runs inline; if it
+    fails, every other attempt runs concurrently on the decode pool. Returns
+    the barcodes of the first attempt to succeed, or [] once all attempts
+    fail or ``deadline`` seconds have passed. Attempts still queued are
+    cancelled; pyzbar and OpenCV release the GIL, so the rest run in parallel.
+    """
+    started = time.monotonic()
+    attempts = iter_decode_attempts(image)
+    _, first_attempt = next(attempts)
+    barcodes = first_attempt()
+    if barcodes:
+        return barcodes
+
+    done_event = threading.Event()
+
+    def run(attempt):
+        # Skip attempts that only start after another one succeeded
+        if done_event.is_set():
+            return []
+        return attempt()
+
+    pool = _get_decode_pool()
+    pending = {pool.submit(run, attempt) for _, attempt in attempts}
+    try:
+        while pending:
+            remaining = deadline - (time.monotonic() - started)
+            if remaining <= 0:
+                print(f"DEBUG - Barcode decode deadline of {deadline}s reached")
+                break
+            finished, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    barcodes = future.result()
+                except Exception as e:
+                    print(f"DEBUG - Barcode decode attempt failed: {str(e)}")
+                    continue
+                if barcodes:
+                    return barcodes
+        return []
+    finally:
+        done_event.set()
+        for future in pending:
+            future.cancel()
+
+
+def decode_all(image: np.ndarray, deadline: float = BARCODE_DECODE_DEADLINE_SECONDS,
+               max_regions: int = BARCODE_SHELF_MAX_REGIONS) -> List[str]:
+    """
+    Every retail barcode in ``image``, e.g. a shelf or a cart. All decode
+    attempts, over up to ``max_regions`` barcode regions, run concurrently on
+    the decode pool and their results are merged (in attempt order, without
+    duplicates); attempts unfinished at ``deadline`` are dropped.
+    """
+    started = time.monotonic()
+    pool = _get_decode_pool()
+    futures = [pool.submit(attempt) for _, attempt in iter_decode_attempts(image, max_regions)]
+    wait(futures, timeout=max(0.0, deadline - (time.monotonic() - started)))
+
+    barcodes = []
+    for future in futures:
+        if not future.done():
+            future.cancel()
+            continue
+        try:
+            found = future.result()
+        except Exception as e:
+            print(f"DEBUG - Barcode decode attempt failed: {str(e)}")
+            continue
+        barcodes += [barcode for barcode in found if barcode not in barcodes]
+    return barcodes
@@ -0,0 +1,107 @@
+"""
+Check the nutrition label parser against the labeled fixture corpus and
+measure its throughput.
+
+    python benchmark_nutrition_parser.py [--corpus fixtures/nutrition_labels.jsonl] [--repeat 2000]
+
+Each corpus line holds an OCR-style label ``text`` and the ``expected``
+fields. The script reports per-field accuracy, nutrient record precision and
+recall, and labels/s and MB/s over ``--repeat`` passes of the corpus.
+"""
+import argparse
+import json
+import math
+import sys
+import time
+from typing import Dict, List
+
+from nutrition_parser import parse_label
+
+
+SCALAR_FIELDS = ['serving_size', 'calories', 'basis', 'ingredients', 'allergens']
+
+
+def load_corpus(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _same_record(record, expected) -> bool:
+    # An optional sixth element marks an upper bound ("<1g")
+    name, amount, unit, daily_value, basis, *less_than = expected
+    return (record.name == name and record.unit == unit and record.basis == basis
+            and record.less_than == bool(less_than and less_than[0])
+            and (record.amount == amount or (record.amount is not None and amount is not None
+                                             and math.isclose(record.amount, amount, rel_tol=1e-6)))
+            and record.daily_value == daily_value)
+
+
+def check_accuracy(corpus: List[Dict]) -> Dict:
+    field_hits = dict.fromkeys(SCALAR_FIELDS, 0)
+    matched = predicted = expected_total = 0
+    failures = []
+    for case in corpus:
+        label = parse_label(case['text'])
+        expected = case['expected']
+        for field in SCALAR_FIELDS:
+            if getattr(label, field) == expected[field]:
+                field_hits[field] += 1
+            else:
+                failures.append(f"{case['id']}: {field} = {getattr(label, field)!r}, expected {expected[field]!r}")
+
+        remaining = list(expected['nutrients'])
+        for record in label.nutrients:
+            match = next((e for e in remaining if _same_record(record, e)), None)
+            if match is None:
+                failures.append(f"{case['id']}: unexpected nutrient {tuple(record)}")
+            else:
+                remaining.remove(match)
+                matched += 1
+        failures += [f"{case['id']}: missing nutrient {tuple(e)}" for e in remaining]
+        predicted += len(label.nutrients)
+        expected_total += len(expected['nutrients'])
+
+    return {
+        'field_accuracy': {field: hits / len(corpus) for field, hits in field_hits.items()},
+        'nutrient_precision': matched / predicted if predicted else 1.0,
+        'nutrient_recall': matched / expected_total if expected_total else 1.0,
+        'failures': failures,
+    }
+
+
+def measure_throughput(corpus: List[Dict], repeat: int) -> Dict:
+    texts = [case['text'] for case in corpus]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            parse_label(text)
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(len(text.encode('utf-8')) for text in texts) * repeat
+    return {
+        'labels_per_second': len(texts) * repeat / elapsed,
+        'mb_per_second': total_bytes / elapsed / 1e6,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default='fixtures/nutrition_labels.jsonl', help="labeled corpus (JSONL)")
+    parser.add_argument('--repeat', type=int, default=2000, help="passes over the corpus for the timing (default: 2000)")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    accuracy = check_accuracy(corpus)
+    throughput = measure_throughput(corpus, args.repeat)
+
+    print(f"{len(corpus)} labeled labels")
+    for field, value in accuracy['field_accuracy'].items():
+        print(f"  {field:<14} {value:>7.1%}")
+    print(f"  nutrient precision {accuracy['nutrient_precision']:.1%}, recall {accuracy['nutrient_recall']:.1%}")
+    print(f"throughput: {throughput['labels_per_second']:,.0f} labels/s, {throughput['mb_per_second']:.1f} MB/s")
+    for failure in accuracy['failures']:
+        print(f"  MISMATCH {failure}")
+    return 1 if accuracy['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Compare OCR preprocessing pipelines on labeled nutrition label photos.
+
+    python benchmark_ocr.py samples/ [--repeat 3]
+
+Every image in the directory (.png/.jpg/.jpeg) needs a ground-truth
+transcription next to it with the same name and a .txt extension. For each
+pipeline the script reports median and p95 preprocessing and OCR latency and
+the mean character accuracy (1 - edit distance / length of the transcription,
+whitespace-normalized).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+import cv2
+import numpy as np
+import pytesseract
+
+from ocr_preprocess import enhance_image, preprocess_for_ocr
+
+
+PIPELINES: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    'enhance_image': enhance_image,
+    'preprocess_for_ocr': preprocess_for_ocr,
+}
+OCR_CONFIG = r'--oem 3 --psm 6'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.split()).lower()
+
+
+def edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def character_accuracy(predicted: str, truth: str) -> float:
+    predicted, truth = normalize_text(predicted), normalize_text(truth)
+    if not truth:
+        return 1.0 if not predicted else 0.0
+    return max(0.0, 1 - edit_distance(predicted, truth) / len(truth))
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def load_samples(directory: str) -> List[tuple]:
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        truth_path = os.path.join(directory, stem + '.txt')
+        if ext.lower() in IMAGE_EXTENSIONS and os.path.exists(truth_path):
+            image = cv2.imread(os.path.join(directory, name))
+            with open(truth_path, encoding='utf-8') as f:
+                samples.append((name, image, f.read()))
+    return samples
+
+
+def run_benchmark(samples: List[tuple], repeat: int) -> Dict[str, Dict]:
+    results = {}
+    for pipeline_name, preprocess in PIPELINES.items():
+        preprocess_times, ocr_times, accuracies = [], [], []
+        for _, image, truth in samples:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                processed = preprocess(image)
+                preprocessed = time.perf_counter()
+                text = pytesseract.image_to_string(processed, config=OCR_CONFIG)
+                preprocess_times.append(preprocessed - started)
+                ocr_times.append(time.perf_counter() - preprocessed)
+            accuracies.append(character_accuracy(text, truth))
+
+        results[pipeline_name] = {
+            'preprocess_median_ms': statistics.median(preprocess_times) * 1000,
+            'preprocess_p95_ms': percentile(preprocess_times, 0.95) * 1000,
+            'ocr_median_ms': statistics.median(ocr_times) * 1000,
+            'ocr_p95_ms': percentile(ocr_times, 0.95) * 1000,
+            'char_accuracy': statistics.mean(accuracies),
+        }
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('samples', help="directory of label photos with .txt transcriptions")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per image (default: 3)")
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.samples)
+    if not samples:
+        print(f"No labeled images found in {args.samples}", file=sys.stderr)
+        return 1
+
+    print(f"{len(samples)} images, {args.repeat} runs each")
+    print(f"{'pipeline':<20} {'prep med':>9} {'prep p95':>9} {'ocr med':>9} {'ocr p95':>9} {'char acc':>9}")
+    for name, result in run_benchmark(samples, args.repeat).items():
+        print(f"{name:<20} {result['preprocess_median_ms']:>7.0f}ms {result['preprocess_p95_ms']:>7.0f}ms "
+              f"{result['ocr_median_ms']:>7.0f}ms {result['ocr_p95_ms']:>7.0f}ms {result['char_accuracy']:>9.1%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Check the dietary pre-screen against the labeled case corpus and measure its
+throughput.
+
+    python benchmark_prescreen.py [--corpus fixtures/prescreen_cases.jsonl] [--repeat 2000]
+
+Each corpus line holds an ingredient list, a profile's ``allergies`` and
+``restrictions``, and the expected ``verdict`` ('unsafe', 'ambiguous' or
+'clear'). Only clear-cut conflicts may be 'unsafe': that verdict skips the
+model. The script reports verdict accuracy and products/s, and exits
+non-zero on any mismatch.
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Dict, List
+
+from dietary_rules import prescreen
+
+
+def load_corpus(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_accuracy(corpus: List[Dict]) -> Dict:
+    failures = []
+    for case in corpus:
+        result = prescreen({'ingredients': case['ingredients']}, case['allergies'], case['restrictions'])
+        if result['verdict'] != case['verdict']:
+            hits = [(hit['term'], hit['certain']) for hit in result['hits']]
+            failures.append(f"{case['id']}: {result['verdict']} {hits}, expected {case['verdict']}")
+    return {
+        'accuracy': 1 - len(failures) / len(corpus) if corpus else 1.0,
+        'failures': failures,
+    }
+
+
+def measure_throughput(corpus: List[Dict], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for case in corpus:
+            prescreen({'ingredients': case['ingredients']}, case['allergies'], case['restrictions'])
+    return len(corpus) * repeat / (time.perf_counter() - started)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default='fixtures/prescreen_cases.jsonl', help="labeled cases (JSONL)")
+    parser.add_argument('--repeat', type=int, default=2000, help="passes over the corpus for the timing (default: 2000)")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    accuracy = check_accuracy(corpus)
+    products_per_second = measure_throughput(corpus, args.repeat)
+
+    print(f"{len(corpus)} labeled cases")
+    print(f"  verdict accuracy {accuracy['accuracy']:.1%}")
+    print(f"throughput: {products_per_second:,.0f} products/s")
+    for failure in accuracy['failures']:
+        print(f"  MISMATCH {failure}")
+    return 1 if accuracy['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Deterministic allergen and dietary-restriction pre-screen.
+
+Product ingredient text is matched against a synonym taxonomy with a single
+precompiled Aho-Corasick automaton, and Open Food Facts allergen tags are
+mapped onto the same taxonomy. The result says whether the product clearly
+conflicts with the user's allergies or dietary restrictions, so the LLM call
+can be skipped, and lists the rule hits to hand to the model otherwise.
+"""
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+# Ingredient groups and the words that indicate them
+TAXONOMY = {
+    'milk': ['milk', 'whey', 'casein', 'caseinate', 'caseinates', 'lactose', 'butter', 'buttermilk', 'cream',
+             'cheese', 'ghee', 'yogurt', 'yoghurt', 'curd', 'curds', 'lactalbumin', 'lactoglobulin', 'milkfat',
+             'milk fat', 'milk solids', 'milk powder', 'skimmed milk'],
+    'egg': ['egg', 'eggs', 'albumen', 'albumin', 'ovalbumin', 'lysozyme', 'mayonnaise', 'meringue', 'egg yolk',
+            'egg white'],
+    'peanut': ['peanut', 'peanuts', 'groundnut', 'groundnuts', 'arachis oil'],
+    'tree nut': ['almond', 'almonds', 'hazelnut', 'hazelnuts', 'walnut', 'walnuts', 'cashew', 'cashews', 'pecan',
+                 'pecans', 'pistachio', 'pistachios', 'macadamia', 'brazil nut', 'brazil nuts', 'nut', 'nuts',
+                 'praline', 'marzipan'],
+    'soy': ['soy', 'soya', 'soybean', 'soybeans', 'tofu', 'edamame', 'miso', 'tempeh'],
+    'gluten': ['wheat', 'barley', 'rye', 'spelt', 'kamut', 'triticale', 'gluten', 'malt', 'semolina', 'durum',
+               'farro', 'bulgur', 'couscous', 'seitan'],
+    'oats': ['oat', 'oats', 'oatmeal'],
+    'fish': ['fish', 'anchovy', 'anchovies', 'cod', 'salmon', 'tuna', 'sardine', 'sardines', 'haddock',
+             'pollock', 'tilapia', 'mackerel', 'trout'],
+    'shellfish': ['shellfish', 'shrimp', 'shrimps', 'prawn', 'prawns', 'crab', 'lobster', 'crayfish', 'scallop',
+                  'scallops', 'clam', 'clams', 'mussel', 'mussels', 'oyster', 'oysters', 'squid', 'octopus',
+                  'crustacean', 'crustaceans', 'mollusc', 'molluscs'],
+    'sesame': ['sesame', 'tahini'],
+    'mustard': ['mustard'],
+    'celery': ['celery', 'celeriac'],
+    'lupin': ['lupin', 'lupine'],
+    'sulphites': ['sulphite', 'sulphites', 'sulfite', 'sulfites', 'sulphur dioxide', 'sulfur dioxide',
+                  'metabisulphite', 'metabisulfite'],
+    'meat': ['meat', 'beef', 'chicken', 'turkey', 'lamb', 'mutton', 'veal', 'duck', 'venison', 'sausage',
+             'meat extract', 'beef extract', 'chicken fat', 'tallow', 'suet'],
+    'pork': ['pork', 'lard', 'bacon', 'ham', 'pancetta', 'prosciutto', 'chorizo', 'salami', 'pepperoni'],
+    'gelatin': ['gelatin', 'gelatine'],
+    'honey': ['honey', 'beeswax', 'royal jelly'],
+    'alcohol': ['alcohol', 'wine', 'beer', 'rum', 'brandy', 'whisky', 'whiskey', 'liqueur', 'vodka', 'ethanol'],
+    'insect': ['carmine', 'cochineal', 'shellac', 'e120'],
+    'animal derived': ['mono and diglycerides', 'mono and di glycerides', 'e471', 'natural flavor',
+                       'natural flavors', 'natural flavour', 'natural flavours', 'l cysteine', 'vitamin d3'],
+}
+
+# Phrases that contain a taxonomy word without indicating its group
+SHADOWS = {
+    'milk': ['coconut milk', 'almond milk', 'oat milk', 'soy milk', 'soya milk', 'rice milk', 'milk thistle',
+             'cocoa butter', 'peanut butter', 'shea butter', 'nut butter', 'cream of tartar', 'butter beans',
+             'milk free', 'dairy free', 'non dairy', 'lactose free', 'cream soda'],
+    'gluten': ['gluten free', 'wheat free'],
+    'egg': ['egg free'],
+    'tree nut': ['nut free', 'coconut', 'nutmeg', 'butternut', 'doughnut', 'peanut', 'peanuts'],
+    'peanut': ['peanut free'],
+    'soy': ['soy free'],
+    'meat': ['meat free'],
+    'alcohol': ['alcohol free', 'sugar alcohol', 'wine vinegar'],
+}
+
+# What a user may type in the allergies field, mapped onto taxonomy groups
+ALLERGY_ALIASES = {
+    'dairy': ['milk'], 'lactose': ['milk'], 'milk': ['milk'], 'casein': ['milk'], 'whey': ['milk'],
+    'egg': ['egg'], 'eggs': ['egg'],
+    'peanut': ['peanut'], 'peanuts': ['peanut'], 'groundnut': ['peanut'],
+    'nut': ['tree nut', 'peanut'], 'nuts': ['tree nut', 'peanut'],
+    'tree nut': ['tree nut'], 'tree nuts': ['tree nut'],
+    'soy': ['soy'], 'soya': ['soy'], 'soybean': ['soy'], 'soybeans': ['soy'],
+    'gluten': ['gluten'], 'wheat': ['gluten'], 'celiac': ['gluten'], 'coeliac': ['gluten'],
+    'fish': ['fish'], 'seafood': ['fish', 'shellfish'],
+    'shellfish': ['shellfish'], 'crustaceans': ['shellfish'], 'shrimp': ['shellfish'],
+    'sesame': ['sesame'], 'mustard': ['mustard'], 'celery': ['celery'], 'lupin': ['lupin'],
+    'sulphites': ['sulphites'], 'sulfites': ['sulphites'],
+}
+
+# Dietary restriction -> {group: certain}. Uncertain groups (source unknown,
+# e.g. gelatin for Halal) only make the product ambiguous.
+RESTRICTION_RULES = {
+    'vegan': {'milk': True, 'egg': True, 'fish': True, 'shellfish': True, 'meat': True, 'pork': True,
+              'gelatin': True, 'honey': True, 'insect': True, 'animal derived': False},
+    'vegetarian': {'fish': True, 'shellfish': True, 'meat': True, 'pork': True, 'gelatin': True,
+                   'insect': False, 'animal derived': False},
+    'gluten-free': {'gluten': True, 'oats': False},
+    'dairy-free': {'milk': True},
+    'halal': {'pork': True, 'alcohol': True, 'gelatin': False, 'meat': False},
+    'kosher': {'pork': True, 'shellfish': True, 'gelatin': False, 'insect': False},
+}
+
+# Open Food Facts allergen tags -> taxonomy groups
+ALLERGEN_TAGS = {
+    'en:milk': 'milk', 'en:eggs': 'egg', 'en:peanuts': 'peanut', 'en:nuts': 'tree nut', 'en:soybeans': 'soy',
+    'en:gluten': 'gluten', 'en:fish': 'fish', 'en:crustaceans': 'shellfish', 'en:molluscs': 'shellfish',
+    'en:sesame-seeds': 'sesame', 'en:mustard': 'mustard', 'en:celery': 'celery', 'en:lupin': 'lupin',
+    'en:sulphur-dioxide-and-sulphites': 'sulphites',
+}
+
+# Precautionary labelling: hits in the same clause are possible, not certain
+PRECAUTION_MARKERS = ['may contain', 'may also contain', 'traces of', 'trace of', 'may be present',
+                      'made in a facility', 'produced in a facility', 'processed in a facility',
+                      'manufactured in a facility', 'shared equipment', 'same equipment', 'same line']
+
+# Dairy words that name a plant product when a plant comes right before them
+# ("coconut cream", "almond butter", "cashew milk")
+DAIRY_FORMS = {'milk', 'butter', 'cream', 'cheese', 'yogurt', 'yoghurt', 'buttermilk'}
+PLANT_MODIFIERS = {'coconut', 'almond', 'cashew', 'oat', 'soy', 'soya', 'rice', 'hemp', 'pea', 'peanut', 'nut',
+                   'hazelnut', 'macadamia', 'pistachio', 'walnut', 'seed', 'sunflower', 'sesame', 'cocoa', 'cacao',
+                   'shea', 'plant', 'vegetable', 'flax', 'quinoa', 'apple', 'mango'}
+
+# Qualifiers anywhere in the same ingredient that make a match doubtful: the
+# model decides, the pre-screen does not short-circuit
+DOUBT_QUALIFIERS = {'vegan', 'vegetarian', 'veggie', 'meatless', 'plant based', 'alternative', 'substitute',
+                    'imitation', 'analogue', 'replacer', 'style', 'flavour', 'flavoured', 'flavor', 'flavored'}
+
+# "no X", "X free", "without X", "non X": X negates its group within the ingredient
+_NEGATION = re.compile(r'\b(?:no|non|without|free from|free of)\s+([a-z]+)|\b([a-z]+)\s+free\b')
+# Removing these leaves the rest of the group: lactose-free milk is still milk
+PARTIAL_NEGATIONS = {'lactose'}
+
+_NON_WORD = re.compile(r'[^a-z0-9]')
+_ITEM_END = re.compile(r'[,;\n]')
+_CLAUSE_END = re.compile(r'[.;()\[\]\n]')
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: one pass over the text finds every occurrence of every pattern"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for pattern in dict.fromkeys(patterns):
+            state = 0
+            for char in pattern:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._out[state].append(len(self.patterns))
+            self.patterns.append(pattern)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Yield ``(start, end, pattern)`` for every match, including overlapping ones"""
+        state = 0
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in out[state]:
+                pattern = patterns[pattern_id]
+                yield i + 1 - len(pattern), i + 1, pattern
+
+
+def _normalize(text: str) -> str:
+    """Lowercase and turn punctuation into spaces, keeping character positions"""
+    return _NON_WORD.sub(' ', text.lower())
+
+
+def _build_matcher() -> Tuple[AhoCorasick, Dict[str, List[Tuple[str, str]]]]:
+    """The process-wide automaton over taxonomy terms, shadows and precaution markers"""
+    roles: Dict[str, List[Tuple[str, str]]] = {}
+    for group, terms in TAXONOMY.items():
+        for term in terms:
+            roles.setdefault(_normalize(term), []).append(('term', group))
+    for group, phrases in SHADOWS.items():
+        for phrase in phrases:
+            roles.setdefault(_normalize(phrase), []).append(('shadow', group))
+    for marker in PRECAUTION_MARKERS:
+        roles.setdefault(_normalize(marker), []).append(('precaution', ''))
+    return AhoCorasick(roles), roles
+
+
+_MATCHER, _ROLES = _build_matcher()
+
+
+@lru_cache(maxsize=256)
+def _literal_matcher(terms: Tuple[str, ...]) -> AhoCorasick:
+    """Automaton for allergy terms that are not in the taxonomy, matched literally"""
+    return AhoCorasick(terms)
+
+
+def _is_word(text: str, start: int, end: int) -> bool:
+    return (start == 0 or text[start - 1] == ' ') and (end == len(text) or text[end] == ' ')
+
+
+def _negated_groups(item: str) -> set:
+    """Groups an ingredient explicitly rules out: "egg free mayonnaise", "ice cream (no dairy)" """
+    groups = set()
+    for match in _NEGATION.finditer(item):
+        word = match.group(1) or match.group(2)
+        if word in PARTIAL_NEGATIONS:
+            continue
+        groups.update(ALLERGY_ALIASES.get(word, []))
+        if word in TAXONOMY:
+            groups.add(word)
+        groups.update(group for role, group in _ROLES.get(word, []) if role == 'term')
+    return groups
+
+
+def _item_bounds(lowered: str) -> List[Tuple[int, int]]:
+    """(start, end) of each comma/semicolon-separated ingredient"""
+    bounds, start = [], 0
+    for match in _ITEM_END.finditer(lowered):
+        bounds.append((start, match.start()))
+        start = match.end()
+    bounds.append((start, len(lowered)))
+    return bounds
+
+
+def match_ingredients(ingredients: str) -> List[Dict]:
+    """
+    Taxonomy matches in an ingredient list: ``{'group', 'term', 'certain'}``
+    for each whole-word occurrence that is not shadowed (e.g. "cocoa
+    butter" for milk).
+
+    Within one ingredient, an explicit negation of the group ("egg-free",
+    "no dairy") or a plant right before a dairy word ("coconut cream")
+    drops the match. Doubtful qualifiers ("vegan", "alternative") and
+    "may contain"/"traces of" clauses make the match uncertain.
+    """
+    lowered = ingredients.lower()
+    text = _NON_WORD.sub(' ', lowered)
+    clause_ends = [m.start() for m in _CLAUSE_END.finditer(lowered)]
+    items = _item_bounds(lowered)
+
+    terms, shadows, precautions = [], [], []
+    for start, end, pattern in _MATCHER.finditer(text):
+        if not _is_word(text, start, end):
+            continue
+        for role, group in _ROLES[pattern]:
+            if role == 'term':
+                terms.append((start, end, group, pattern))
+            elif role == 'shadow':
+                shadows.append((start, end, group))
+            else:
+                clause_end = next((pos for pos in clause_ends if pos >= end), len(text))
+                precautions.append((start, clause_end))
+
+    matches, kept = [], []
+    for start, end, group, term in sorted(terms, key=lambda t: (t[0], t[0] - t[1])):
+        if any(s <= start and end <= e and g == group for s, e, g in shadows):
+            continue
+        # Overlapping words of one group are one match: "skimmed milk powder" is milk once
+        if any(start < e and s < end and g == group for s, e, g in kept):
+            continue
+        kept.append((start, end, group))
+
+        item_start, item_end = next((s, e) for s, e in items if s <= start <= e)
+        item = ' '.join(text[item_start:item_end].split())
+        previous_word = text[item_start:start].split()[-1:]
+        if group in _negated_groups(item):
+            continue
+        if term in DAIRY_FORMS and previous_word and previous_word[0] in PLANT_MODIFIERS:
+            continue
+
+        certain = not any(s <= start < e for s, e in precautions)
+        if certain and any(_is_phrase_in(qualifier, item) for qualifier in DOUBT_QUALIFIERS):
+            certain = False
+        matches.append({'group': group, 'term': term, 'certain': certain})
+    return matches
+
+
+def _is_phrase_in(phrase: str, text: str) -> bool:
+    return f' {phrase} ' in f' {text} '
+
+
+def _allergy_groups(allergies: List[str]) -> Tuple[Dict[str, str], Tuple[str, ...]]:
+    """Map allergy terms onto taxonomy groups; return the mapping and the unmapped literal terms"""
+    groups, literals = {}, []
+    for allergy in allergies:
+        key = ' '.join(_normalize(allergy).split())
+        if key in ALLERGY_ALIASES:
+            for group in ALLERGY_ALIASES[key]:
+                groups.setdefault(group, allergy)
+        elif key in TAXONOMY:
+            groups.setdefault(key, allergy)
+        elif key:
+            literals.append(key)
+    return groups, tuple(literals)
+
+
+def prescreen(product_info: Dict, allergies: List[str], dietary_restrictions: List[str]) -> Dict:
+    """
+    Check a product (as returned by get_product_info) against a user's
+    allergies and dietary restrictions.
+
+    Returns ``{'verdict': 'unsafe' | 'ambiguous' | 'clear', 'hits': [...]}``,
+    where each hit is ``{'kind': 'allergy' | 'restriction', 'rule', 'group',
+    'term', 'source': 'ingredients' | 'allergens', 'certain'}``. The verdict is
+    'unsafe' when any hit is certain.
+    """
+    ingredients = product_info.get('ingredients') or ''
+    matches = match_ingredients(ingredients)
+    for tag in product_info.get('allergens') or []:
+        group = ALLERGEN_TAGS.get(tag)
+        if group:
+            matches.append({'group': group, 'term': tag.replace('en:', ''), 'certain': True, 'source': 'allergens'})
+
+    allergy_groups, literals = _allergy_groups(allergies)
+    if literals:
+        text = _normalize(ingredients)
+        for start, end, term in _literal_matcher(literals).finditer(text):
+            if _is_word(text, start, end):
+                matches.append({'group': term, 'term': term, 'certain': True})
+                allergy_groups.setdefault(term, term)
+
+    restriction_rules = {
+        restriction: RESTRICTION_RULES[restriction.lower()]
+        for restriction in dietary_restrictions
+        if restriction.lower() in RESTRICTION_RULES
+    }
+
+    hits, seen = [], set()
+    for match in matches:
+        source = match.get('source', 'ingredients')
+        candidates = []
+        if match['group'] in allergy_groups:
+            candidates.append(('allergy', allergy_groups[match['group']], match['certain']))
+        for restriction, rules in restriction_rules.items():
+            if match['group'] in rules:
+                candidates.append(('restriction', restriction, match['certain'] and rules[match['group']]))
+        for kind, rule, certain in candidates:
+            key = (kind, rule, match['term'], certain)
+            if key not in seen:
+                seen.add(key)
+                hits.append({'kind': kind, 'rule': rule, 'group': match['group'], 'term': match['term'],
+                             'source': source, 'certain': certain})
+
+    if any(hit['certain'] for hit in hits):
+        verdict = 'unsafe'
+    elif hits:
+        verdict = 'ambiguous'
+    else:
+        verdict = 'clear'
+    return {'verdict': verdict, 'hits': hits}
+
+
+def describe_hit(hit: Dict) -> str:
+    """One-line, user-facing description of a rule hit"""
+    found = f"{hit['term']} ({hit['group']})" if hit['term'] != hit['group'] else hit['term']
+    where = "the allergen list" if hit['source'] == 'allergens' else "the ingredients"
+    qualifier = "" if hit['certain'] else "Possibly "
+    if hit['kind'] == 'allergy':
+        return f"{qualifier}{found} in {where}, matching your {hit['rule']} allergy"
+    return f"{qualifier}{found} in {where}, which conflicts with {hit['rule']}"
+
+
+def prescreen_analysis(product_info: Dict, result: Dict) -> Dict:
+    """Typed analysis (the same shape parse_analysis returns) for a product the pre-screen found unsafe"""
+    certain = [hit for hit in result['hits'] if hit['certain']]
+    allergy_hits = [describe_hit(hit) for hit in result['hits'] if hit['kind'] == 'allergy']
+    restriction_hits = [describe_hit(hit) for hit in result['hits'] if hit['kind'] == 'restriction']
+    conflicts = sorted({hit['rule'] for hit in certain})
+    return {
+        'rating': 'Unsafe',
+        'summary': f"Contains {', '.join(sorted({hit['term'] for hit in certain}))}, "
+                   f"which conflicts with your profile ({', '.join(conflicts)}).",
+        'allergens': [tag.replace('en:', '') for tag in product_info.get('allergens') or []],
+        'findings': {
+            'allergen_risk': allergy_hits,
+            'dietary_compliance': restriction_hits,
+            'nutritional_impact': [],
+            'health_considerations': [],
+        },
+        'recommendations': [
+            "Avoid this product.",
+            f"Look for an alternative that is free from {', '.join(sorted({hit['group'] for hit in certain}))}.",
+        ],
+    }
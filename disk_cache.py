@@ -0,0 +1,106 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+
+class DiskCache:
+    """
+    Persistent key/value cache shared by every session and process on the host.
+
+    Values are JSON-serialisable and stored in a SQLite table (WAL mode) with
+    a per-entry expiry. ``None`` is a valid value, so callers can cache
+    negative results. The table is bounded to ``max_entries``: when it grows
+    past that, expired rows and then the least recently used rows are deleted.
+    """
+
+    # Access times are only rewritten when older than this, so hot keys do
+    # not turn every read into a write
+    ACCESS_RESOLUTION_SECONDS = 60
+
+    def __init__(self, path: str, table: str, max_entries: int, default_ttl: float):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._stats_lock = threading.Lock()
+        self._writes_since_trim = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    " key TEXT PRIMARY KEY,"
+                    " value TEXT NOT NULL,"
+                    " expires_at REAL NOT NULL,"
+                    " accessed_at REAL NOT NULL)"
+                )
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at ON {self.table} (accessed_at)"
+                )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Optional[Any]]:
+        """Return ``(True, value)`` on a hit and ``(False, None)`` on a miss or expired entry"""
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute(
+            f"SELECT value, expires_at, accessed_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] <= now:
+            self._count('misses')
+            return False, None
+
+        if now - row[2] > self.ACCESS_RESOLUTION_SECONDS:
+            with conn:
+                conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count('hits')
+        return True, json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + (self.default_ttl if ttl is None else ttl)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, now),
+            )
+        self._writes_since_trim += 1
+        if self._writes_since_trim >= max(1, self.max_entries // 100):
+            self._writes_since_trim = 0
+            self._trim(conn, now)
+
+    def _trim(self, conn: sqlite3.Connection, now: float) -> None:
+        with conn:
+            evicted = conn.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)).rowcount
+            count = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if count > self.max_entries:
+                evicted += conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f" SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+        if evicted:
+            self._count('evictions', evicted)
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters for this process, plus the hit rate"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[counter] += amount
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import google.generativeai as genai
+import streamlit as st
+
+
+GENAI_MODEL_NAME = os.getenv('GENAI_MODEL_NAME', 'gemini-2.0-flash')
+GENAI_HEALTH_CHECK_INTERVAL_SECONDS = float(os.getenv('GENAI_HEALTH_CHECK_INTERVAL_SECONDS', '300'))
+
+_model: Optional[genai.GenerativeModel] = None
+_model_lock = threading.Lock()
+_health_thread: Optional[threading.Thread] = None
+_health = {'healthy': None, 'last_checked': None, 'last_error': None}
+_health_lock = threading.Lock()
+
+
+def _get_api_key() -> str:
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        try:
+            api_key = st.secrets["api"]["GOOGLE_API_KEY"]
+        except Exception:
+            api_key = None
+
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable is not set. Please check your API key configuration.")
+    return api_key
+
+
+def get_model() -> genai.GenerativeModel:
+    """
+    Process-wide Gemini model client. The SDK is configured and the model
+    object built once; later calls return the same client immediately.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                genai.configure(api_key=_get_api_key())
+                _model = genai.GenerativeModel(GENAI_MODEL_NAME)
+    return _model
+
+
+def check_health() -> bool:
+    """
+    Check that the API is reachable with the configured key. Uses the model
+    metadata endpoint, which costs no generation quota.
+    """
+    try:
+        get_model()
+        genai.get_model(f"models/{GENAI_MODEL_NAME}")
+        healthy, error = True, None
+    except Exception as e:
+        healthy, error = False, str(e)
+        print(f"DEBUG - Gemini health check failed: {error}")
+
+    with _health_lock:
+        _health.update(healthy=healthy, last_checked=time.time(), last_error=error)
+    return healthy
+
+
+def get_health() -> Dict:
+    """Result of the most recent background health check"""
+    with _health_lock:
+        return dict(_health)
+
+
+def _health_check_loop() -> None:
+    while True:
+        check_health()
+        time.sleep(GENAI_HEALTH_CHECK_INTERVAL_SECONDS)
+
+
+def start() -> None:
+    """
+    Warm the client and start the background health checks, once per process.
+    The first check runs immediately, so the client and its connection are
+    ready before the first analysis.
+    """
+    global _health_thread
+    with _health_lock:
+        if _health_thread is not None:
+            return
+        _health_thread = threading.Thread(target=_health_check_loop, name='genai-health-check', daemon=True)
+        _health_thread.start()
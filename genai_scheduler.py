@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+
+# Requests per minute allowed by our Gemini quota, and how many may go out back to back
+GENAI_REQUESTS_PER_MINUTE = float(os.getenv('GENAI_REQUESTS_PER_MINUTE', '15'))
+GENAI_BURST = int(os.getenv('GENAI_BURST', '3'))
+# Callers allowed to wait for a slot, and how long they may wait before being rejected
+GENAI_MAX_QUEUE = int(os.getenv('GENAI_MAX_QUEUE', '50'))
+GENAI_MAX_WAIT_SECONDS = float(os.getenv('GENAI_MAX_WAIT_SECONDS', '30'))
+# Retries of a request rejected with 429/503
+GENAI_MAX_RETRIES = int(os.getenv('GENAI_MAX_RETRIES', '4'))
+GENAI_BACKOFF_BASE_SECONDS = float(os.getenv('GENAI_BACKOFF_BASE_SECONDS', '1'))
+GENAI_BACKOFF_MAX_SECONDS = float(os.getenv('GENAI_BACKOFF_MAX_SECONDS', '20'))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+)
+
+
+class SchedulerBusy(Exception):
+    """The request was not admitted: the wait queue is full or the wait timed out"""
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second, holding at most ``capacity``. Not thread-safe."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def time_until_token(self) -> float:
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the API reports the quota exhausted"""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+
+class GenAIScheduler:
+    """
+    Admission control in front of Gemini. Callers queue by priority (then
+    arrival) and are released one at a time as the token bucket allows, so a
+    burst of scans is spread over the quota instead of failing with 429s.
+    Requests the API still rejects with 429/503 are retried with jittered
+    exponential backoff. The caller's own thread runs the request.
+    """
+
+    def __init__(self, requests_per_minute: float = GENAI_REQUESTS_PER_MINUTE, burst: int = GENAI_BURST,
+                 max_queue: int = GENAI_MAX_QUEUE, max_wait: float = GENAI_MAX_WAIT_SECONDS,
+                 max_retries: int = GENAI_MAX_RETRIES):
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._metrics = {
+            'admitted': 0, 'rejected': 0, 'retries': 0,
+            'total_wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+        }
+
+    def _admit(self, priority: int, max_wait: float) -> None:
+        """Block until this caller is first in line and a token is available"""
+        entry = (priority, next(self._sequence))
+        deadline = time.monotonic() + max_wait
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self._metrics['rejected'] += 1
+                raise SchedulerBusy("Too many analyses are waiting, please try again shortly")
+            heapq.heappush(self._queue, entry)
+            started = time.monotonic()
+            try:
+                while True:
+                    if self._queue[0] == entry and self._bucket.try_take():
+                        heapq.heappop(self._queue)
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        self._metrics['rejected'] += 1
+                        raise SchedulerBusy("The analysis service is busy, please try again shortly")
+                    wait = self._bucket.time_until_token() if self._queue[0] == entry else remaining
+                    self._cond.wait(min(max(wait, 0.01), remaining))
+            finally:
+                self._cond.notify_all()
+
+            waited = time.monotonic() - started
+            self._metrics['admitted'] += 1
+            self._metrics['total_wait_seconds'] += waited
+            self._metrics['max_wait_seconds'] = max(self._metrics['max_wait_seconds'], waited)
+
+    def call(self, fn: Callable, priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None):
+        """
+        Run ``fn()`` (a Gemini request) once admitted and return its result.
+        Raises SchedulerBusy if not admitted within ``max_wait`` seconds, or
+        the API error once retries are exhausted.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        for attempt in range(self.max_retries + 1):
+            self._admit(priority, max_wait)
+            try:
+                return fn()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._cond:
+                    self._metrics['retries'] += 1
+                    if isinstance(e, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+                        self._bucket.drain()
+                delay = min(GENAI_BACKOFF_MAX_SECONDS, GENAI_BACKOFF_BASE_SECONDS * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+                print(f"DEBUG - Gemini returned {e.__class__.__name__}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def max_delay(self) -> float:
+        """Longest a call can spend queued and backing off, on top of its own requests"""
+        backoff = sum(min(GENAI_BACKOFF_MAX_SECONDS, GENAI_BACKOFF_BASE_SECONDS * 2 ** attempt)
+                      for attempt in range(self.max_retries))
+        return self.max_wait * (self.max_retries + 1) + backoff
+
+    def metrics(self) -> Dict:
+        """Queue depth, admissions, rejections, retries and wait times"""
+        with self._cond:
+            metrics = dict(self._metrics, queue_depth=len(self._queue))
+        admitted = metrics['admitted']
+        metrics['avg_wait_seconds'] = metrics['total_wait_seconds'] / admitted if admitted else 0.0
+        return metrics
+
+
+_scheduler: Optional[GenAIScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> GenAIScheduler:
+    """Process-wide scheduler, shared by all sessions"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = GenAIScheduler()
+    return _scheduler
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+# Hashes at most this many bits apart (of 64) count as the same picture
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv('IMAGE_CACHE_MAX_DISTANCE', '4'))
+
+# Rough per-entry bookkeeping cost, on top of the cached value
+_ENTRY_OVERHEAD_BYTES = 200
+_HASH_BITS = 64
+
+
+def upload_identity(data: bytes) -> str:
+    """Identity of an uploaded or captured file: a digest of its bytes, the same across reruns and users"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(image: np.ndarray) -> int:
+    """
+    64-bit difference hash: the image is shrunk to 9x8 gray pixels and each
+    bit records whether a pixel is brighter than its right neighbour. Small
+    changes (recompression, resizing, slight exposure shifts) flip few bits.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def _sizeof(value: Any) -> int:
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class ImageResultCache:
+    """
+    Thread-safe LRU cache of results computed from images (decoded barcodes,
+    OCR text), bounded by the approximate memory its values use.
+
+    Entries are keyed by (kind, upload identity), which is shared by all
+    users: identical bytes give identical results. They also carry the
+    image's perceptual hash and a scope (the session that computed them). A
+    lookup that misses on identity may be served from an entry of the same
+    kind and scope whose hash is within ``max_distance`` bits, but only if
+    the caller's ``verify`` accepts its value for the new image: different
+    products of one brand photograph alike, so a near hash alone never
+    decides. Without ``verify`` only the exact same upload is a hit, and
+    empty results (nothing decoded) are never near matches.
+
+    Near-match candidates come from a band index: the 64-bit hash is split
+    into ``max_distance + 1`` bands, and two hashes within ``max_distance``
+    bits agree on at least one whole band, so only entries sharing a band
+    are compared.
+    """
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_MAX_BYTES, max_distance: int = IMAGE_CACHE_MAX_DISTANCE):
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self._entries: OrderedDict = OrderedDict()
+        self._bands: Dict[tuple, Set[Tuple[str, str]]] = defaultdict(set)
+        self._band_bits = -(-_HASH_BITS // (max_distance + 1))
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _band_keys(self, kind: str, scope: str, phash: int):
+        mask = (1 << self._band_bits) - 1
+        for band in range(self.max_distance + 1):
+            yield kind, scope, band, (phash >> (band * self._band_bits)) & mask
+
+    def _unindex(self, key: Tuple[str, str]) -> Tuple[int, Any, int]:
+        phash, value, size, scope = self._entries.pop(key)
+        if scope is not None:
+            for band_key in self._band_keys(key[0], scope, phash):
+                self._bands[band_key].discard(key)
+                if not self._bands[band_key]:
+                    del self._bands[band_key]
+        return phash, value, size
+
+    def get(self, kind: str, identity: str, phash: int, scope: Optional[str] = None,
+            verify: Optional[Callable[[Any], bool]] = None) -> Tuple[bool, Any]:
+        """
+        Return (found, value). Near matches are looked up within ``scope`` and
+        returned only if ``verify(value)`` is true; verify runs outside the lock.
+        """
+        key = (kind, identity)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return True, self._entries[key][1]
+            near = []
+            if scope is not None and verify is not None:
+                candidates = set().union(*(self._bands.get(band_key, ())
+                                           for band_key in self._band_keys(kind, scope, phash)))
+                near = [
+                    (candidate, self._entries[candidate][1]) for candidate in candidates
+                    if self._entries[candidate][1]
+                    and bin(self._entries[candidate][0] ^ phash).count('1') <= self.max_distance
+                ]
+
+        match = next(((candidate, value) for candidate, value in near if verify(value)), None)
+        with self._lock:
+            if match is None:
+                self._misses += 1
+                return False, None
+            if match[0] in self._entries:
+                self._entries.move_to_end(match[0])
+            self._hits += 1
+            return True, match[1]
+
+    def set(self, kind: str, identity: str, phash: int, value: Any, scope: Optional[str] = None) -> None:
+        size = _sizeof(value) + _ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            key = (kind, identity)
+            if key in self._entries:
+                self._bytes -= self._unindex(key)[2]
+            self._entries[key] = (phash, value, size, scope)
+            if scope is not None:
+                for band_key in self._band_keys(kind, scope, phash):
+                    self._bands[band_key].add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._bytes -= self._unindex(next(iter(self._entries)))[2]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+            }
+
+
+image_cache = ImageResultCache()
@@ -0,0 +1,144 @@
+"""
+Build the local barcode index from an Open Food Facts data export.
+
+    python import_off_dump.py openfoodfacts-products.jsonl.gz data/off
+    python import_off_dump.py en.openfoodfacts.org.products.csv.gz data/off
+
+The export is streamed line by line; each product is projected down to the
+fields get_product_info returns and written to <output>.dat, and the sorted
+barcode table to <output>.idx. Point OFF_INDEX_PATH at <output> to use it.
+"""
+import argparse
+import array
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from off_api import normalize_product
+from product_index import INDEX_ENTRY, INDEX_HEADER, INDEX_MAGIC, normalize_barcode
+
+
+# CSV export columns that map onto the product document's nutriments
+CSV_NUTRIMENTS = [
+    'energy-kcal_100g', 'fat_100g', 'proteins_100g', 'carbohydrates_100g',
+    'sugars_100g', 'fiber_100g', 'sodium_100g',
+]
+
+
+def open_dump(path: str) -> io.TextIOBase:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace', newline='')
+    return open(path, 'r', encoding='utf-8', errors='replace', newline='')
+
+
+def iter_jsonl_products(f) -> Iterator[Tuple[str, Dict]]:
+    """Yield (barcode, product document) from the JSONL export"""
+    for line in f:
+        try:
+            product = json.loads(line)
+        except ValueError:
+            continue
+        yield str(product.get('code', '')), product
+
+
+def iter_csv_products(f) -> Iterator[Tuple[str, Dict]]:
+    """Yield (barcode, product document) from the tab-separated CSV export"""
+    csv.field_size_limit(sys.maxsize)
+    for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+        nutriments = {}
+        for key in CSV_NUTRIMENTS:
+            value = _to_number(row.get(key))
+            if value is not None:
+                nutriments[key] = value
+
+        product = {'nutriments': nutriments}
+        for key in ('product_name', 'serving_size', 'ingredients_text'):
+            if row.get(key):
+                product[key] = row[key]
+        allergens = row.get('allergens_tags') or row.get('allergens') or ''
+        product['allergens_hierarchy'] = [a for a in allergens.split(',') if a]
+        yield row.get('code', ''), product
+
+
+def _to_number(value: Optional[str]):
+    if not value:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def build_index(dump_path: str, output_prefix: str, dump_format: str) -> int:
+    """Stream ``dump_path`` into <output_prefix>.dat/.idx and return the number of products indexed"""
+    keys = []
+    offsets = array.array('Q')
+    lengths = array.array('I')
+    positions = {}
+    skipped = 0
+
+    dat_tmp = f"{output_prefix}.dat.tmp"
+    idx_tmp = f"{output_prefix}.idx.tmp"
+    iter_products = iter_csv_products if dump_format == 'csv' else iter_jsonl_products
+
+    started = time.monotonic()
+    with open_dump(dump_path) as f, open(dat_tmp, 'wb') as dat:
+        offset = 0
+        for barcode, product in iter_products(f):
+            key = normalize_barcode(barcode)
+            if key is None:
+                skipped += 1
+                continue
+
+            record = json.dumps(normalize_product(product), separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+            dat.write(record)
+
+            # A later duplicate replaces the earlier entry; its old record is left unreferenced
+            if key in positions:
+                i = positions[key]
+                offsets[i], lengths[i] = offset, len(record)
+            else:
+                positions[key] = len(keys)
+                keys.append(key)
+                offsets.append(offset)
+                lengths.append(len(record))
+                if len(keys) % 100000 == 0:
+                    print(f"{len(keys)} products...", file=sys.stderr)
+            offset += len(record)
+
+    del positions
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    with open(idx_tmp, 'wb') as idx:
+        idx.write(INDEX_HEADER.pack(INDEX_MAGIC, len(keys)))
+        for i in order:
+            idx.write(INDEX_ENTRY.pack(keys[i], offsets[i], lengths[i]))
+
+    os.replace(dat_tmp, f"{output_prefix}.dat")
+    os.replace(idx_tmp, f"{output_prefix}.idx")
+    print(f"Indexed {len(keys)} products ({skipped} skipped) in {time.monotonic() - started:.1f}s", file=sys.stderr)
+    return len(keys)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dump', help="Open Food Facts JSONL or CSV export (optionally .gz)")
+    parser.add_argument('output', help="output path prefix; writes <output>.idx and <output>.dat")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="export format (default: from the file name)")
+    args = parser.parse_args(argv)
+
+    dump_format = args.format or ('csv' if '.csv' in os.path.basename(args.dump) else 'jsonl')
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    build_index(args.dump, args.output, dump_format)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import os
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+
+# Longest side of the copy the layout is analysed on
+LABEL_LAYOUT_MAX_SIDE = 1200
+LABEL_MAX_REGIONS = int(os.getenv('LABEL_MAX_REGIONS', '4'))
+# Horizontal rules needed for a text block to count as a nutrition facts table
+NUTRITION_TABLE_MIN_RULES = 3
+
+# Tesseract page segmentation modes: a table is read as a single column of
+# lines of varying size, a paragraph (ingredients) as one uniform block
+PSM_TABLE = 4
+PSM_BLOCK = 6
+
+
+class LabelRegion:
+    """A text region of a label photo: its kind ('nutrition' or 'text'), deskewed crop and OCR mode"""
+
+    __slots__ = ('kind', 'image', 'psm', 'box')
+
+    def __init__(self, kind: str, image: np.ndarray, psm: int, box: Tuple[int, int, int, int]):
+        self.kind = kind
+        self.image = image
+        self.psm = psm
+        self.box = box
+
+
+def _count_rules(rules: np.ndarray) -> int:
+    count, _ = cv2.connectedComponents(rules)
+    return count - 1
+
+
+def _deskew(crop: np.ndarray, angle: float) -> np.ndarray:
+    # minAreaRect reports angles in (0, 90]; bring them to (-45, 45]
+    if angle > 45:
+        angle -= 90
+    if abs(angle) < 1:
+        return crop
+    h, w = crop.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    # Enlarge the canvas to the rotated bounding box so corners of the text are not clipped
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_w, new_h = int(h * sin + w * cos), int(h * cos + w * sin)
+    matrix[0, 2] += new_w / 2 - w / 2
+    matrix[1, 2] += new_h / 2 - h / 2
+    return cv2.warpAffine(crop, matrix, (new_w, new_h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def find_label_regions(image: np.ndarray, max_regions: int = LABEL_MAX_REGIONS) -> List[LabelRegion]:
+    """
+    Find the text blocks of a label photo, nutrition facts table first and
+    then the other blocks (ingredients, allergen statements) by text density,
+    and return full-resolution deskewed crops of them. Ranking by density
+    rather than area keeps a small, dense ingredient paragraph ahead of large
+    blocks that are mostly artwork.
+
+    The layout is analysed on a downscaled copy: dark text is isolated with a
+    black-hat filter and dilated until lines merge into blocks. A block
+    crossed by several long horizontal rules is taken to be the nutrition
+    table. Returns [] when no block stands out, so callers can OCR the whole
+    image instead.
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    scale = min(1.0, LABEL_LAYOUT_MAX_SIDE / max(gray.shape[:2]))
+    small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    height, width = small.shape
+
+    blackhat = cv2.morphologyEx(small, cv2.MORPH_BLACKHAT, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 7)))
+    _, text_mask = cv2.threshold(blackhat, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    block_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 40), max(5, height // 60)))
+    blocks = cv2.morphologyEx(text_mask, cv2.MORPH_CLOSE, block_kernel, iterations=2)
+
+    binary = cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    rules = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(20, width // 8), 1)))
+
+    contours, _ = cv2.findContours(blocks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    candidates = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < width * height * 0.02 or w * h > width * height * 0.95:
+            continue
+        is_table = _count_rules(rules[y:y + h, x:x + w]) >= NUTRITION_TABLE_MIN_RULES
+        density = cv2.countNonZero(text_mask[y:y + h, x:x + w]) / (w * h)
+        candidates.append((not is_table, -density, (x, y, w, h), cv2.minAreaRect(contour)[2]))
+
+    regions = []
+    for not_table, _, (x, y, w, h), angle in sorted(candidates)[:max_regions]:
+        margin_x, margin_y = int(w * 0.03) + 4, int(h * 0.03) + 4
+        x0, y0 = int(max(0, x - margin_x) / scale), int(max(0, y - margin_y) / scale)
+        x1 = int(min(width, x + w + margin_x) / scale)
+        y1 = int(min(height, y + h + margin_y) / scale)
+        crop = _deskew(image[y0:y1, x0:x1], angle)
+        kind, psm = ('text', PSM_BLOCK) if not_table else ('nutrition', PSM_TABLE)
+        regions.append(LabelRegion(kind, crop, psm, (x0, y0, x1 - x0, y1 - y0)))
+    return regions
@@ -8,6 +8,8 @@ from PIL import Image
 import numpy as np
 import cv2
 from auth import *
+import genai_client
+from profile_writer import get_profile_writer, flush_profile_writes, close_profile_writer
 
 # TEMPORARY CODE TO CLEAR PRODUCT HISTORY - REMOVE AFTER RUNNING ONCE
 
@@ -81,6 +83,9 @@ with open("styles.css") as f:
 # Initialize authentication
 initialize_auth()
 
+# Build and warm the shared Gemini client (no-op after the first run in this process)
+genai_client.start()
+
 
 
 if 'run_analysis_for_barcode' in st.session_state:
@@ -113,11 +118,15 @@ with st.sidebar:
     st.write(f"👤 Logged in as: {st.session_state.get('username', '')}")
     st.markdown('<div class="danger-button">', unsafe_allow_html=True)
     if st.button("Logout", use_container_width=True):
-        # Clear only authentication-related state
-        st.session_state['authenticated'] = False
-        st.session_state['username'] = None
-        st.session_state['step'] = 'welcome' 
-        st.rerun()
+        # Make sure staged profile and history writes reach storage before the session goes
+        if st.session_state.get('username') and not close_profile_writer(st.session_state['username']):
+            st.error("Your latest changes could not be saved yet. Please try logging out again in a moment.")
+        else:
+            # Clear only authentication-related state
+            st.session_state['authenticated'] = False
+            st.session_state['username'] = None
+            st.session_state['step'] = 'welcome' 
+            st.rerun()
     st.markdown('</div>', unsafe_allow_html=True)
 
 
@@ -221,7 +230,7 @@ if st.session_state.step == 'welcome':
                             """, unsafe_allow_html=True)
                             
                             if st.button(f"View Details", key=f"history_{i}"):
-                                st.session_state.analysis_results = product['full_analysis']
+                                st.session_state.analysis_results = get_history_analysis(product)
                                 st.session_state.from_history = True
                                 st.session_state.step = 'results'
                                 st.rerun()
@@ -239,7 +248,7 @@ if st.session_state.step == 'welcome':
                             st.markdown(f"**{product['product_name']}** - {product['timestamp']}")
                             st.markdown(f"_{product['analysis_summary']}_")
                             if st.button(f"View Details", key=f"unsafe_{i}"):
-                                st.session_state.analysis_results = product['full_analysis']
+                                st.session_state.analysis_results = get_history_analysis(product)
                                 st.session_state.from_history = True
                                 st.session_state.step = 'results'
                                 st.rerun()
@@ -251,7 +260,7 @@ if st.session_state.step == 'welcome':
                             st.markdown(f"**{product['product_name']}** - {product['timestamp']}")
                             st.markdown(f"_{product['analysis_summary']}_")
                             if st.button(f"View Details", key=f"caution_{i}"):
-                                st.session_state.analysis_results = product['full_analysis']
+                                st.session_state.analysis_results = get_history_analysis(product)
                                 st.session_state.from_history = True
                                 st.session_state.step = 'results'
                                 st.rerun()
@@ -263,7 +272,7 @@ if st.session_state.step == 'welcome':
                             st.markdown(f"**{product['product_name']}** - {product['timestamp']}")
                             st.markdown(f"_{product['analysis_summary']}_")
                             if st.button(f"View Details", key=f"safe_{i}"):
-                                st.session_state.analysis_results = product['full_analysis']
+                                st.session_state.analysis_results = get_history_analysis(product)
                                 st.session_state.from_history = True
                                 st.session_state.step = 'results'
                                 st.rerun()
@@ -308,9 +317,9 @@ elif st.session_state.step == 'personal_info':
 
                 if valid:
                     st.session_state.user_data.update(user_data)  # Add this line
-                    # Save user data
+                    # Stage user data; written together with the health info step
                     if st.session_state.get('username'):
-                        save_user_profile(st.session_state['username'], st.session_state.user_data)
+                        get_profile_writer(st.session_state['username']).stage_profile(st.session_state.user_data)
                     st.session_state.step = 'health_info'
                     st.rerun()
                 else:
@@ -363,9 +372,10 @@ elif st.session_state.step == 'health_info':
                     'dietary_restrictions': dietary_restrictions
                 })
 
-                # Save the complete user profile
+                # Save the complete user profile (one write for both onboarding steps)
                 if st.session_state.get('username'):
-                    save_user_profile(st.session_state['username'], st.session_state.user_data)
+                    get_profile_writer(st.session_state['username']).stage_profile(st.session_state.user_data)
+                    flush_profile_writes(st.session_state['username'])
                 # Different navigation based on flow type
                 if st.session_state.flow_type == 'onboarding':
                     st.session_state.step = 'barcode_scanning'
@@ -386,7 +396,7 @@ elif st.session_state.step == 'barcode_scanning':
         st.rerun()
 
     # Create tabs for different input methods
-    tab1, tab2 = st.tabs(["📸 Use Camera", "📤 Upload Image"])
+    tab1, tab2, tab3 = st.tabs(["📸 Use Camera", "📤 Upload Image", "🛒 Multiple Products"])
 
     with tab1:
         st.info("Use your device's camera to capture the barcode")
@@ -400,7 +410,7 @@ elif st.session_state.step == 'barcode_scanning':
             try:
                 # Convert PIL Image to OpenCV format
                 img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                barcode = scan_barcode(img_cv)
+                barcode = scan_barcode(img_cv, image_id=upload_identity(camera_image.getvalue()))
                 # print(f"DEBUG - Detected barcode: {barcode}, type: {type(barcode)}")
 
                 if barcode:
@@ -424,7 +434,7 @@ elif st.session_state.step == 'barcode_scanning':
             try:
                 # Convert PIL Image to OpenCV format
                 img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                barcode = scan_barcode(img_cv)
+                barcode = scan_barcode(img_cv, image_id=upload_identity(uploaded_file.getvalue()))
 
                 if barcode:
                     handle_barcode(barcode)
@@ -436,6 +446,29 @@ elif st.session_state.step == 'barcode_scanning':
                 st.info("Please try again with a clearer image or contact support if the problem persists.")
 
 
+    with tab3:
+        st.info("Photograph a shelf or your cart to analyze every product whose barcode is visible")
+        batch_file = st.file_uploader("Choose an image", type=["png", "jpg", "jpeg"], key="batch_uploader")
+
+        if batch_file is not None:
+            image = Image.open(batch_file)
+            st.image(image, caption="Uploaded Products", use_container_width=True)
+
+            try:
+                img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+                barcodes = scan_barcodes(img_cv, image_id=upload_identity(batch_file.getvalue()))
+
+                if barcodes:
+                    st.success(f"Found {len(barcodes)} barcode(s): {', '.join(barcodes)}")
+                    if st.button(f"Analyze {len(barcodes)} Products", key="batch_analyze_btn"):
+                        run_batch_analyze(barcodes)
+                else:
+                    st.error("Could not detect any barcodes in the image. Please ensure the barcodes are clearly visible.")
+            except Exception as e:
+                st.error(f"An error occurred: {str(e)}")
+                st.info("Please try again with a clearer image or contact support if the problem persists.")
+
+
     # Back button at the bottom (existing)
     col1, col2 = st.columns(2)
     with col1:
@@ -456,7 +489,7 @@ elif st.session_state.step == 'results':
         # Show a badge if viewing from history
         if st.session_state.get('from_history', False):
             st.info("You are viewing a previously analyzed product from your history")
-        st.markdown(st.session_state.analysis_results)
+        st.markdown(render_analysis_markdown(st.session_state.analysis_results))
 
     if st.session_state.get('from_history', False):
         col1, col2 = st.columns(2)
@@ -528,6 +561,25 @@ elif st.session_state.step == 'results':
                 
                 st.rerun()
 
+# Results for a multi-barcode scan
+elif st.session_state.step == 'batch_results':
+    st.header("Analysis Results")
+
+    if st.session_state.get('batch_results'):
+        render_batch_verdicts(st.session_state.batch_results)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Scan More Products"):
+            st.session_state.batch_results = None
+            st.session_state.step = 'barcode_scanning'
+            st.rerun()
+    with col2:
+        if st.button("Return to Home", key="batch_home_btn"):
+            st.session_state.batch_results = None
+            st.session_state.step = 'welcome'
+            st.rerun()
+
 # Footer
 st.markdown("---")
 st.markdown("Made with ❤️ for dietary safety")
@@ -0,0 +1,192 @@
+import re
+from typing import List, NamedTuple, Optional
+
+
+class NutrientRecord(NamedTuple):
+    """
+    One nutrient line: amount in ``unit`` ('g', 'kcal' or 'IU'; None if only
+    a %DV is printed). ``less_than`` marks an upper bound ("Sugars <1g").
+    """
+    name: str
+    amount: Optional[float]
+    unit: Optional[str]
+    daily_value: Optional[float]
+    basis: str
+    less_than: bool = False
+
+
+class ParsedLabel(NamedTuple):
+    """Fields of an OCR'd nutrition label; ``basis`` is 'serving' or '100g'"""
+    serving_size: Optional[str]
+    calories: Optional[float]
+    ingredients: str
+    allergens: str
+    nutrients: List[NutrientRecord]
+    basis: str
+
+
+# Printed nutrient names -> the keys normalize_product uses (plus a few more)
+NUTRIENT_ALIASES = {
+    'total fat': 'fat', 'fat': 'fat', 'fats': 'fat',
+    'saturated fat': 'saturated_fat', 'sat fat': 'saturated_fat', 'saturates': 'saturated_fat',
+    'of which saturates': 'saturated_fat',
+    'trans fat': 'trans_fat',
+    'cholesterol': 'cholesterol',
+    'sodium': 'sodium', 'salt': 'salt',
+    'total carbohydrate': 'carbohydrates', 'total carbohydrates': 'carbohydrates', 'total carb': 'carbohydrates',
+    'carbohydrate': 'carbohydrates', 'carbohydrates': 'carbohydrates', 'total carbs': 'carbohydrates',
+    'dietary fiber': 'fiber', 'dietary fibre': 'fiber', 'fiber': 'fiber', 'fibre': 'fiber',
+    'total sugars': 'sugars', 'sugars': 'sugars', 'sugar': 'sugars', 'of which sugars': 'sugars',
+    'added sugars': 'added_sugars',
+    'protein': 'proteins', 'proteins': 'proteins',
+    'vitamin d': 'vitamin_d', 'calcium': 'calcium', 'iron': 'iron', 'potassium': 'potassium',
+}
+
+# Factor to the canonical unit: masses to grams, energy to kcal
+UNIT_FACTORS = {
+    'g': ('g', 1.0), 'mg': ('g', 1e-3), 'mcg': ('g', 1e-6), 'µg': ('g', 1e-6), 'ug': ('g', 1e-6),
+    'kcal': ('kcal', 1.0), 'cal': ('kcal', 1.0), 'kj': ('kcal', 1 / 4.184), 'iu': ('IU', 1.0),
+}
+
+_NUMBER = r'\d+(?:[.,]\d+)?'
+
+# One pattern per kind of line, tried in order as alternatives of a single
+# compiled regex: each line is matched once and dispatched on lastgroup.
+_LINE = re.compile('|'.join([
+    r'(?P<serving>serving\s+size\b\s*[:\-]?\s*(?P<serving_value>.*))',
+    r'(?P<energy>(?:calories(?!\s+from)|energy|energie)\b\D*?(?P<energy_amount>' + _NUMBER + r')\s*(?P<energy_unit>kcal|kj|cal)?)',
+    r'(?P<basis>(?:[a-z ]*\s)?per\s+(?P<basis_value>serving|100\s*(?:g|ml))\b)',
+    r'(?P<ingredients>ingredients?\b\s*[:\-]?\s*(?P<ingredients_value>.*))',
+    r'(?P<allergens>(?:contains(?!\s+\d)|allergens?|may\s+contain)\b\s*[:\-]?\s*(?P<allergens_value>.+))',
+    # "Contains 2% or less of: salt, ..." belongs to the ingredients, not the nutrients
+    r'(?P<minor>contains\s+' + _NUMBER + r'\s*%\s+or\s+less\b.*)',
+    r'(?P<added>includes\s+(?P<added_amount>' + _NUMBER + r')\s*(?P<added_unit>mg|g)\s+added\s+sugars?'
+    r'(?:\D*?(?P<added_dv>' + _NUMBER + r')\s*%)?)',
+    r"(?P<nutrient>(?!contains\b)(?P<nutrient_name>[a-zµ][a-z0-9 .,'/\-]*?)\s*"
+    r'(?P<nutrient_less><\s*|less\s+than\s+)?(?P<nutrient_amount>' + _NUMBER + r'|o(?=\s*m?g\b))\s*'
+    r'(?P<nutrient_unit>mcg|µg|ug|mg|g|kcal|kj|iu|%)(?![a-z])'
+    r'(?:\D*?(?P<nutrient_dv>' + _NUMBER + r')\s*%)?)',
+]), re.IGNORECASE)
+
+_KCAL = re.compile(r'(' + _NUMBER + r')\s*kcal', re.IGNORECASE)
+# A basis printed on the nutrient's own line ("Salt 0.1 g per 100 g")
+_INLINE_BASIS = re.compile(r'\bper\s+(serving|100\s*(?:g|ml))\b', re.IGNORECASE)
+
+# Lines that end an ingredients paragraph that runs over several lines
+_SECTION_BREAKS = {'serving', 'energy', 'basis', 'allergens'}
+
+
+def _number(text: str) -> float:
+    text = text.strip().lower()
+    return 0.0 if text == 'o' else float(text.replace(',', '.'))
+
+
+def _normalize_amount(amount: str, unit: str):
+    canonical, factor = UNIT_FACTORS[unit.lower()]
+    # Six significant digits: drops float noise from the conversion, keeps micrograms
+    return float(f"{_number(amount) * factor:.6g}"), canonical
+
+
+def _nutrient_key(name: str) -> str:
+    name = ' '.join(name.lower().replace('-', ' ').strip(" .,:'/").split())
+    return NUTRIENT_ALIASES.get(name, name.replace(' ', '_'))
+
+
+def parse_label(text: str) -> ParsedLabel:
+    """
+    Parse OCR text of a nutrition label in one pass over its lines.
+
+    Nutrient amounts are normalized to grams (energy to kcal), with the %DV
+    when printed. Values are per serving unless the label says "per 100 g"
+    (or 100 ml); the basis applies to the lines after it, or to its own line
+    when printed after a nutrient's amount. An ingredients
+    paragraph continues until a blank line or another section starts.
+    """
+    serving_size = None
+    calories = None
+    ingredients, allergens = [], []
+    nutrients: List[NutrientRecord] = []
+    basis = 'serving'
+    in_ingredients = False
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            in_ingredients = False
+            continue
+
+        match = _LINE.match(line)
+        kind = match.lastgroup if match else None
+        # Within an ingredients paragraph only a new section counts; "milk 2%" is still an ingredient
+        if in_ingredients and kind not in _SECTION_BREAKS:
+            ingredients.append(line)
+            continue
+        in_ingredients = False
+
+        if kind == 'serving':
+            serving_size = match.group('serving_value').strip() or serving_size
+        elif kind == 'energy':
+            # Labels that print both kJ and kcal (on one line or two): keep the kcal figure
+            kcal = _KCAL.search(line)
+            if kcal:
+                calories = _number(kcal.group(1))
+            elif calories is None or (match.group('energy_unit') or 'kcal').lower() != 'kj':
+                calories, _ = _normalize_amount(match.group('energy_amount'), match.group('energy_unit') or 'kcal')
+        elif kind == 'basis':
+            basis = 'serving' if match.group('basis_value').lower() == 'serving' else '100g'
+        elif kind == 'ingredients':
+            in_ingredients = True
+            if match.group('ingredients_value').strip():
+                ingredients.append(match.group('ingredients_value').strip())
+        elif kind == 'minor':
+            ingredients.append(line)
+        elif kind == 'allergens':
+            allergens.append(match.group('allergens_value').strip())
+        elif kind == 'added':
+            amount, unit = _normalize_amount(match.group('added_amount'), match.group('added_unit'))
+            dv = match.group('added_dv')
+            nutrients.append(NutrientRecord('added_sugars', amount, unit, _number(dv) if dv else None, basis))
+        elif kind == 'nutrient':
+            unit = match.group('nutrient_unit')
+            dv = match.group('nutrient_dv')
+            if unit == '%':
+                amount, unit, dv = None, None, match.group('nutrient_amount')
+            else:
+                amount, unit = _normalize_amount(match.group('nutrient_amount'), unit)
+            inline_basis = _INLINE_BASIS.search(line, match.end('nutrient_unit'))
+            record_basis = basis
+            if inline_basis:
+                record_basis = 'serving' if inline_basis.group(1).lower() == 'serving' else '100g'
+            nutrients.append(NutrientRecord(_nutrient_key(match.group('nutrient_name')), amount, unit,
+                                            _number(dv) if dv else None, record_basis,
+                                            bool(match.group('nutrient_less'))))
+
+    return ParsedLabel(
+        serving_size=serving_size,
+        calories=calories,
+        ingredients=' '.join(ingredients),
+        allergens='; '.join(allergens),
+        nutrients=nutrients,
+        basis=basis,
+    )
+
+
+def _display_amount(amount: float, unit: str) -> str:
+    # Small masses read better in mg or µg than as fractions of a gram
+    if unit == 'g' and 0 < amount < 1e-4:
+        amount, unit = amount * 1e6, 'µg'
+    elif unit == 'g' and 0 < amount < 0.1:
+        amount, unit = amount * 1e3, 'mg'
+    return f"{float(f'{amount:.6g}'):g} {unit}"
+
+
+def describe_nutrient(record: NutrientRecord) -> str:
+    """One prompt line for a nutrient, e.g. "Sodium: 0.16 g (7% DV) per serving" or "Vitamin d: 2 µg per 100g" """
+    name = record.name.replace('_', ' ').capitalize()
+    amount = None
+    if record.amount is not None:
+        amount = ('<' if record.less_than else '') + _display_amount(record.amount, record.unit)
+    parts = [amount,
+             f"({record.daily_value:g}% DV)" if record.daily_value is not None else None]
+    value = ' '.join(part for part in parts if part)
+    return f"{name}: {value} per {'serving' if record.basis == 'serving' else '100g'}"
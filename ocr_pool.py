@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Optional
+
+import numpy as np
+from PIL import Image
+import pytesseract
+
+# tesserocr binds the Tesseract API directly: each worker keeps an engine with
+# its traindata loaded and is handed images in memory. Without it, every call
+# falls back to pytesseract, which starts a tesseract process per image.
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+
+OCR_POOL_SIZE = int(os.getenv('OCR_POOL_SIZE', str(os.cpu_count() or 2)))
+OCR_TIMEOUT_SECONDS = float(os.getenv('OCR_TIMEOUT_SECONDS', '20'))
+OCR_LANGUAGE = os.getenv('OCR_LANGUAGE', 'eng')
+
+
+class OCRPool:
+    """
+    Pool of long-lived OCR workers. Each worker thread owns one Tesseract
+    engine, created on its first job and reused for every later one;
+    tesserocr releases the GIL while recognizing, so workers run in parallel.
+
+    Every job carries a deadline: recognition is cancelled when it passes
+    (and a job still queued by then is skipped), so slow images free their
+    worker instead of holding it after the caller has given up.
+    """
+
+    def __init__(self, size: int = OCR_POOL_SIZE, language: str = OCR_LANGUAGE, timeout: float = OCR_TIMEOUT_SECONDS):
+        self.size = size
+        self.language = language
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='ocr')
+        self._local = threading.local()
+
+    def _engine(self):
+        engine = getattr(self._local, 'engine', None)
+        if engine is None:
+            engine = tesserocr.PyTessBaseAPI(lang=self.language, oem=tesserocr.OEM.DEFAULT)
+            self._local.engine = engine
+        return engine
+
+    def _recognize(self, image, psm: int, deadline: float, preprocess: Optional[Callable] = None) -> str:
+        if deadline <= time.monotonic():
+            raise TimeoutError("OCR timed out before a worker was free")
+        if preprocess is not None:
+            image = preprocess(image)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("OCR timed out while preprocessing")
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if tesserocr is None:
+            # pytesseract kills the tesseract process when the timeout passes
+            return pytesseract.image_to_string(image, lang=self.language, config=f'--oem 3 --psm {psm}',
+                                               timeout=remaining)
+        engine = self._engine()
+        engine.SetPageSegMode(psm)
+        engine.SetImage(image)
+        if not engine.Recognize(timeout=max(1, int(remaining * 1000))):
+            raise TimeoutError("OCR timed out")
+        return engine.GetUTF8Text()
+
+    def submit(self, image, psm: int = 6, timeout: Optional[float] = None, preprocess: Optional[Callable] = None):
+        """
+        Queue an image (numpy array or PIL image) for OCR and return the
+        future of its text. ``preprocess``, if given, runs on the worker
+        first. The job is abandoned ``timeout`` seconds (default: the pool's)
+        from now, whether it is queued or running.
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        return self._executor.submit(self._recognize, image, psm, deadline, preprocess)
+
+    def image_to_string(self, image, psm: int = 6, timeout: Optional[float] = None,
+                        preprocess: Optional[Callable] = None) -> str:
+        """
+        OCR an image with page segmentation mode ``psm``. Raises TimeoutError
+        if the text is not ready within ``timeout`` seconds (default: the
+        pool's), counting time spent waiting for a free worker.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(image, psm, timeout, preprocess)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError("OCR timed out")
+
+
+_pool: Optional[OCRPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_pool() -> OCRPool:
+    """Process-wide OCR pool, shared by all sessions"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OCRPool()
+    return _pool
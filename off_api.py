@@ -0,0 +1,94 @@
+import os
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+OFF_PRODUCT_URL = "https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
+
+# Only the keys normalize_product reads; the full product document is often
+# several hundred KB
+OFF_FIELDS = "product_name,serving_size,nutriments,ingredients_text,allergens_hierarchy"
+
+OFF_CONNECT_TIMEOUT = float(os.getenv('OFF_CONNECT_TIMEOUT_SECONDS', '3.05'))
+OFF_READ_TIMEOUT = float(os.getenv('OFF_READ_TIMEOUT_SECONDS', '10'))
+OFF_MAX_RETRIES = int(os.getenv('OFF_MAX_RETRIES', '2'))
+OFF_POOL_SIZE = int(os.getenv('OFF_POOL_SIZE', '20'))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Process-wide keep-alive session for Open Food Facts.
+
+    Connections are pooled across Streamlit sessions, and failed requests
+    (connection errors, 429 and 5xx) are retried a bounded number of times with
+    jittered exponential backoff, honouring Retry-After.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=OFF_MAX_RETRIES,
+                    connect=OFF_MAX_RETRIES,
+                    read=OFF_MAX_RETRIES,
+                    status=OFF_MAX_RETRIES,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(['GET']),
+                    backoff_factor=0.3,
+                    backoff_jitter=0.3,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=OFF_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = 'NutriScanAI/1.0 (streamlit app)'
+                _session = session
+    return _session
+
+
+def fetch_product(barcode: str) -> Optional[Dict]:
+    """
+    Fetch the raw (field-projected) product document for ``barcode``.
+    Returns None when Open Food Facts does not know the product.
+    """
+    response = get_session().get(
+        OFF_PRODUCT_URL.format(barcode=barcode),
+        params={'fields': OFF_FIELDS},
+        timeout=(OFF_CONNECT_TIMEOUT, OFF_READ_TIMEOUT),
+    )
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = response.json()
+
+    if data.get('status') != 1:
+        return None
+    return data['product']
+
+
+def normalize_product(product: Dict) -> Dict:
+    """Reduce an Open Food Facts product document to the nutrition info the app uses"""
+    nutriments = product.get('nutriments') or {}
+    return {
+        'product_name': product.get('product_name', 'Unknown Product'),
+        'serving_size': product.get('serving_size', 'Not specified'),
+        'calories': nutriments.get('energy-kcal_100g', 'Not specified'),
+        'ingredients': product.get('ingredients_text', ''),
+        'allergens': product.get('allergens_hierarchy', []),
+        'nutrients': {
+            'fat': nutriments.get('fat_100g', 'Not specified'),
+            'proteins': nutriments.get('proteins_100g', 'Not specified'),
+            'carbohydrates': nutriments.get('carbohydrates_100g', 'Not specified'),
+            'sugars': nutriments.get('sugars_100g', 'Not specified'),
+            'fiber': nutriments.get('fiber_100g', 'Not specified'),
+            'sodium': nutriments.get('sodium_100g', 'Not specified')
+        }
+    }
@@ -0,0 +1,107 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Optional
+
+
+# <prefix>.idx: header, then `count` fixed-width entries sorted by key
+#   entry = 14-byte ASCII GTIN (zero-padded) + uint64 offset + uint32 length
+# <prefix>.dat: the packed compact-JSON records the entries point into
+INDEX_MAGIC = b'OFFIDX01'
+INDEX_HEADER = struct.Struct('<8sQ')
+INDEX_ENTRY = struct.Struct('<14sQI')
+KEY_WIDTH = 14
+
+
+def normalize_barcode(barcode: str) -> Optional[bytes]:
+    """
+    Index key for a barcode: its GTIN-14 form (digits, left-padded with zeros),
+    so EAN-13, UPC-A and EAN-8 spellings of the same code share one key.
+    Returns None for codes that are not 1-14 digits.
+    """
+    barcode = barcode.strip()
+    if not barcode.isdigit() or len(barcode) > KEY_WIDTH:
+        return None
+    return barcode.zfill(KEY_WIDTH).encode('ascii')
+
+
+class ProductIndex:
+    """
+    Read-only, memory-mapped barcode index built by import_off_dump.py.
+
+    Lookups binary-search the sorted key table in place and decode a single
+    record, so opening the index costs no parsing and each lookup touches only
+    a few pages.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        with open(f"{prefix}.idx", 'rb') as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(f"{prefix}.dat", 'rb') as f:
+            # mmap cannot map an empty file (an index built from an empty dump)
+            self._dat = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+        magic, self.count = INDEX_HEADER.unpack_from(self._idx, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{prefix}.idx is not a product index")
+        if len(self._idx) != INDEX_HEADER.size + self.count * INDEX_ENTRY.size:
+            raise ValueError(f"{prefix}.idx is truncated")
+
+    def _key_at(self, i: int) -> bytes:
+        start = INDEX_HEADER.size + i * INDEX_ENTRY.size
+        return self._idx[start:start + KEY_WIDTH]
+
+    def get(self, barcode: str) -> Optional[Dict]:
+        """Return the stored nutrition info for ``barcode``, or None if it is not indexed"""
+        key = normalize_barcode(barcode)
+        if key is None:
+            return None
+
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count or self._key_at(lo) != key:
+            return None
+
+        _, offset, length = INDEX_ENTRY.unpack_from(self._idx, INDEX_HEADER.size + lo * INDEX_ENTRY.size)
+        return json.loads(self._dat[offset:offset + length])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        self._idx.close()
+        if isinstance(self._dat, mmap.mmap):
+            self._dat.close()
+
+
+_index: Optional[ProductIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_product_index() -> Optional[ProductIndex]:
+    """
+    Process-wide index at OFF_INDEX_PATH (path prefix without extension), or
+    None when no index is configured or it cannot be opened
+    """
+    global _index, _index_loaded
+    if not _index_loaded:
+        with _index_lock:
+            if not _index_loaded:
+                prefix = os.getenv('OFF_INDEX_PATH')
+                if prefix:
+                    try:
+                        _index = ProductIndex(prefix)
+                        print(f"DEBUG - Loaded product index {prefix} with {len(_index)} products")
+                    except Exception as e:
+                        print(f"DEBUG - Could not open product index {prefix}: {str(e)}")
+                _index_loaded = True
+    return _index
@@ -0,0 +1,66 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class CacheEntry:
+    """A cached object body together with the ETag it was served with"""
+
+    __slots__ = ('etag', 'data', 'fetched_at')
+
+    def __init__(self, etag: str, data: Any, fetched_at: float):
+        self.etag = etag
+        self.data = data
+        self.fetched_at = fetched_at
+
+
+class ProfileCache:
+    """
+    Bounded, thread-safe LRU cache of profile objects keyed by username.
+
+    Entries younger than ``ttl_seconds`` are served without touching S3.
+    Older entries are kept so their ETag can be sent as If-None-Match; a 304
+    answer only refreshes the entry's timestamp via ``touch``.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return the entry for ``key`` (fresh or stale) and mark it recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.fetched_at < self.ttl_seconds
+
+    def put(self, key: str, data: Any, etag: str) -> None:
+        """Store ``data`` for ``key``, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = CacheEntry(etag, copy.deepcopy(data), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, key: str) -> None:
+        """Mark an entry as revalidated (the server answered 304 Not Modified)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.fetched_at = time.monotonic()
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,126 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from auth import update_user_profile, replace_profile_fields
+
+
+PROFILE_WRITE_DEBOUNCE_SECONDS = float(os.getenv('PROFILE_WRITE_DEBOUNCE_SECONDS', '10'))
+# Delay before retrying a failed flush, doubled after each further failure
+PROFILE_WRITE_RETRY_BASE_SECONDS = float(os.getenv('PROFILE_WRITE_RETRY_BASE_SECONDS', '5'))
+PROFILE_WRITE_RETRY_MAX_SECONDS = float(os.getenv('PROFILE_WRITE_RETRY_MAX_SECONDS', '300'))
+
+
+class ProfileWriter:
+    """
+    Write-behind buffer for one user's profile.
+
+    Profile edits and history entries are staged in memory and written in a
+    single conditional PUT by ``flush``: either explicitly (step transitions,
+    logout) or by a debounce timer once no new change has been staged for
+    ``debounce_seconds``. A newer profile snapshot supersedes an older staged
+    one, so several saves of the same form cost one write. A failed flush
+    keeps the changes staged and retries them with exponential backoff.
+    """
+
+    def __init__(self, username: str, debounce_seconds: float = PROFILE_WRITE_DEBOUNCE_SECONDS):
+        self.username = username
+        self.debounce_seconds = debounce_seconds
+        self._profile_data: Optional[Dict] = None
+        self._mutations: List[Callable[[Dict], None]] = []
+        self._timer: Optional[threading.Timer] = None
+        self._failures = 0
+        self._lock = threading.RLock()
+
+    def stage_profile(self, profile_data: Dict) -> None:
+        """Stage a full snapshot of the user's profile fields"""
+        with self._lock:
+            self._profile_data = dict(profile_data)
+            self._schedule_flush()
+
+    def stage(self, mutation: Callable[[Dict], None]) -> None:
+        """Stage an in-place mutation of the stored profile (e.g. a history entry)"""
+        with self._lock:
+            self._mutations.append(mutation)
+            self._schedule_flush()
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return self._profile_data is not None or bool(self._mutations)
+
+    def flush(self, report_errors: bool = True) -> bool:
+        """
+        Write every staged change in one PUT. Returns True if nothing is left
+        pending; otherwise a retry is scheduled.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.has_pending():
+                return True
+
+            profile_data, mutations = self._profile_data, list(self._mutations)
+
+            def apply_pending(stored_profile: Dict) -> None:
+                if profile_data is not None:
+                    replace_profile_fields(profile_data)(stored_profile)
+                for mutation in mutations:
+                    mutation(stored_profile)
+
+            if not update_user_profile(self.username, apply_pending, report_errors=report_errors):
+                self._failures += 1
+                delay = min(PROFILE_WRITE_RETRY_MAX_SECONDS,
+                            PROFILE_WRITE_RETRY_BASE_SECONDS * 2 ** (self._failures - 1))
+                print(f"DEBUG - Failed to flush profile writes for {self.username}, retrying in {delay:.0f}s")
+                self._schedule_flush(delay)
+                return False
+
+            self._failures = 0
+            self._profile_data = None
+            del self._mutations[:len(mutations)]
+            return True
+
+    def _flush_in_background(self) -> None:
+        # Runs on the timer thread, outside any Streamlit script: log errors instead of st.error
+        self.flush(report_errors=False)
+
+    def _schedule_flush(self, delay: Optional[float] = None) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.debounce_seconds if delay is None else delay, self._flush_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+_writers: Dict[str, ProfileWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_profile_writer(username: str) -> ProfileWriter:
+    """Return the process-wide writer for ``username``, creating it if needed"""
+    with _writers_lock:
+        writer = _writers.get(username)
+        if writer is None:
+            writer = _writers[username] = ProfileWriter(username)
+        return writer
+
+
+def flush_profile_writes(username: str) -> bool:
+    """Flush any staged writes for ``username``"""
+    with _writers_lock:
+        writer = _writers.get(username)
+    if writer is None:
+        return True
+    return writer.flush()
+
+
+def close_profile_writer(username: str) -> bool:
+    """Flush and forget the writer for ``username`` (used on logout)"""
+    flushed = flush_profile_writes(username)
+    if flushed:
+        with _writers_lock:
+            writer = _writers.get(username)
+            if writer is not None and not writer.has_pending():
+                del _writers[username]
+    return flushed
@@ -0,0 +1,170 @@
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+
+# Total prompt size and the share the ingredient list may take, in (estimated) tokens
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '1000'))
+INGREDIENTS_TOKEN_BUDGET = int(os.getenv('INGREDIENTS_TOKEN_BUDGET', '300'))
+
+# Gemini averages roughly four characters per token on English text
+CHARS_PER_TOKEN = 4
+
+ANALYSIS_PROMPT_TEMPLATE = """As a nutrition and dietary safety expert, assess this product for the user below. Reply with JSON matching the response schema; keep each item one short sentence, adding detail only where it matters as a warning for this user.
+
+USER: age {age_band}; health conditions: {health_conditions}; allergies: {allergies}; dietary restrictions: {dietary_restrictions}
+
+PRODUCT:
+{nutrition_info}
+{prescreen_text}
+FIELDS:
+- assessment: rating (Safe/Caution/Unsafe) and a 1-2 sentence summary
+- allergens: allergens present
+- findings.allergen_risk: allergens relevant to the user, cross-contamination, severity
+- findings.dietary_compliance: conflicts with the dietary restrictions
+- findings.nutritional_impact: key nutrients vs. the user's conditions, calories, portion size
+- findings.health_considerations: effects on the user's conditions, medication interactions, long-term use
+- recommendations: safe-consumption advice, alternatives, portion sizes
+
+Be accurate and specific about risks. A food that is safe but not especially healthy (like chocolate) is still Safe."""
+
+_LANGUAGE_PREFIX = re.compile(r'\b[a-z]{2}:(?=\w)')
+_EMPHASIS = re.compile(r'[_*]+')
+_WHITESPACE = re.compile(r'\s+')
+_INGREDIENTS_LINE = re.compile(r'^Ingredients: (.*)$', re.MULTILINE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate, used to enforce budgets without a count_tokens round trip"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_ingredients(text: str) -> List[str]:
+    """Split an ingredient list on top-level commas/semicolons, keeping parenthesised sub-lists intact"""
+    items, depth, current = [], 0, []
+    for char in text:
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth = max(0, depth - 1)
+        if char in ',;' and depth == 0:
+            items.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    items.append(''.join(current))
+    return items
+
+
+def compact_ingredients(text: str, max_tokens: int = INGREDIENTS_TOKEN_BUDGET) -> str:
+    """
+    Normalize an Open Food Facts ingredient list for the prompt: drop language
+    prefixes ("en:") and _emphasis_ markers, collapse whitespace, remove
+    case-insensitive duplicates, and cut the list at ``max_tokens``, noting how
+    many ingredients were left out. Ingredients are listed by weight, so the
+    ones dropped are the minor ones.
+    """
+    text = _WHITESPACE.sub(' ', _EMPHASIS.sub('', _LANGUAGE_PREFIX.sub('', text or '')))
+    seen, items = set(), []
+    for item in split_ingredients(text):
+        item = item.strip(' .')
+        if item and item.lower() not in seen:
+            seen.add(item.lower())
+            items.append(item)
+
+    kept, used = [], 0
+    for i, item in enumerate(items):
+        cost = estimate_tokens(item) + 1
+        if used + cost > max_tokens:
+            return ', '.join(kept) + f" ... ({len(items) - i} more)"
+        kept.append(item)
+        used += cost
+    return ', '.join(kept)
+
+
+def fit_nutrition_info(nutrition_info: str, max_tokens: int) -> str:
+    """
+    Shrink formatted nutrition info towards ``max_tokens`` by cutting its
+    ingredient list further. Nothing else is cut: the allergen and nutrient
+    lines are always kept whole, even if that leaves the text over budget.
+    """
+    excess = estimate_tokens(nutrition_info) - max_tokens
+    if excess <= 0:
+        return nutrition_info
+
+    match = _INGREDIENTS_LINE.search(nutrition_info)
+    if match:
+        ingredients_budget = max(0, estimate_tokens(match.group(1)) - excess - 8)
+        nutrition_info = (
+            nutrition_info[:match.start(1)]
+            + compact_ingredients(match.group(1), ingredients_budget)
+            + nutrition_info[match.end(1):]
+        )
+    return nutrition_info
+
+
+def build_prompt(fields: Dict[str, str], nutrition_info: str, token_budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    """
+    Fill the analysis template, trimming the nutrition info so the whole
+    prompt stays within ``token_budget``. ``fields`` holds the other
+    placeholders (profile fields and pre-screen text).
+    """
+    fixed_tokens = estimate_tokens(ANALYSIS_PROMPT_TEMPLATE.format(nutrition_info='', **fields))
+    nutrition_info = fit_nutrition_info(nutrition_info, max(0, token_budget - fixed_tokens))
+    return ANALYSIS_PROMPT_TEMPLATE.format(nutrition_info=nutrition_info, **fields)
+
+
+class TokenUsageLog:
+    """Recent per-call token counts and latencies, to relate prompt size to latency"""
+
+    def __init__(self, max_records: int = 1000):
+        self._records = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def record(self, usage_metadata, latency_seconds: float, estimated_input_tokens: int) -> None:
+        """Record a call from the response's usage_metadata (falls back to the estimate if absent)"""
+        record = {
+            'input_tokens': getattr(usage_metadata, 'prompt_token_count', None) or estimated_input_tokens,
+            'output_tokens': getattr(usage_metadata, 'candidates_token_count', None) or 0,
+            'estimated_input_tokens': estimated_input_tokens,
+            'latency_seconds': latency_seconds,
+        }
+        with self._lock:
+            self._records.append(record)
+
+    def stats(self, bucket_tokens: int = 250) -> Dict:
+        """
+        Totals and averages over the recorded calls, plus average latency per
+        input-size bucket of ``bucket_tokens``
+        """
+        with self._lock:
+            records = list(self._records)
+        if not records:
+            return {'calls': 0}
+
+        buckets: Dict[int, List[float]] = {}
+        for record in records:
+            bucket = record['input_tokens'] // bucket_tokens * bucket_tokens
+            buckets.setdefault(bucket, []).append(record['latency_seconds'])
+
+        calls = len(records)
+        return {
+            'calls': calls,
+            'avg_input_tokens': sum(r['input_tokens'] for r in records) / calls,
+            'avg_output_tokens': sum(r['output_tokens'] for r in records) / calls,
+            'avg_latency_seconds': sum(r['latency_seconds'] for r in records) / calls,
+            'latency_by_input_tokens': {
+                f"{bucket}-{bucket + bucket_tokens - 1}": sum(latencies) / len(latencies)
+                for bucket, latencies in sorted(buckets.items())
+            },
+        }
+
+    def recent(self, n: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            records = list(self._records)
+        return records[-n:] if n else records
+
+
+token_usage = TokenUsageLog()
@@ -16,5 +16,7 @@
     pkgs.lcms2
     pkgs.freetype
     pkgs.tesseract
+    pkgs.leptonica
+    pkgs.pkg-config
   ];
 }
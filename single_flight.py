@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Tuple
+
+
+class FlightAbandoned(Exception):
+    """The leader gave up without a result; followers should acquire() again"""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller (the leader)
+    does the work, and callers arriving while it is in flight wait on its
+    future instead of repeating it.
+
+    Followers wait at most ``timeout`` seconds and then do the work
+    themselves, and an entry older than ``timeout`` is no longer joined, so a
+    stuck leader can delay callers but never block them indefinitely. A
+    leader that fails or is abandoned does not hand its exception to the
+    followers: they are woken to retry, and one of them becomes the leader.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._in_flight: Dict[str, Tuple[Future, float]] = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'followers': 0, 'timeouts': 0, 'abandoned': 0}
+
+    def acquire(self, key: str) -> Tuple[bool, Future]:
+        """
+        Join the in-flight call for ``key``, or start one. Returns
+        (is_leader, future); a leader must call release() or abandon() when done.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._in_flight.get(key)
+            if entry is not None and now - entry[1] < self.timeout:
+                self._stats['followers'] += 1
+                return False, entry[0]
+            future = Future()
+            self._in_flight[key] = (future, now)
+            self._stats['leaders'] += 1
+            return True, future
+
+    def _retire(self, key: str, future: Future) -> None:
+        with self._lock:
+            entry = self._in_flight.get(key)
+            if entry is not None and entry[0] is future:
+                del self._in_flight[key]
+
+    def release(self, key: str, future: Future, result) -> None:
+        """Publish the leader's result to its followers and retire the entry"""
+        self._retire(key, future)
+        if not future.done():
+            future.set_result(result)
+
+    def abandon(self, key: str, future: Future) -> None:
+        """Retire the entry without a result; its followers get FlightAbandoned and retry"""
+        self._retire(key, future)
+        with self._lock:
+            self._stats['abandoned'] += 1
+        if not future.done():
+            future.set_exception(FlightAbandoned())
+
+    def wait(self, future: Future):
+        """
+        Result of a joined call. Raises TimeoutError if the leader takes longer
+        than ``timeout``, or FlightAbandoned if it gave up.
+        """
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise TimeoutError("Timed out waiting for an identical in-flight request")
+
+    def do(self, key: str, fn: Callable):
+        """Run ``fn()`` once for all concurrent callers with the same key and return its result"""
+        while True:
+            is_leader, future = self.acquire(key)
+            if is_leader:
+                break
+            try:
+                return self.wait(future)
+            except FlightAbandoned:
+                continue
+            except TimeoutError:
+                return fn()
+
+        try:
+            result = fn()
+        except BaseException:
+            self.abandon(key, future)
+            raise
+        self.release(key, future, result)
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._in_flight))
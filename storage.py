@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+
+class NotModified(Exception):
+    """Raised by ``get`` when the stored version still matches ``if_none_match``"""
+
+
+class PreconditionFailed(Exception):
+    """Raised by ``put`` when the stored version no longer matches the expected one"""
+
+
+class StoredObject:
+    """A JSON document read from storage and the version (ETag) it was read at"""
+
+    __slots__ = ('data', 'etag')
+
+    def __init__(self, data: Any, etag: str):
+        self.data = data
+        self.etag = etag
+
+
+class StorageBackend(ABC):
+    """
+    Versioned JSON document store used for credentials and user profiles.
+
+    Keys are path-like strings (e.g. ``users/profiles/<username>.json``).
+    Every write produces a new opaque version string, used for conditional
+    reads (``if_none_match``) and optimistic-concurrency writes (``if_match``).
+    """
+
+    @abstractmethod
+    def get(self, key: str, if_none_match: Optional[str] = None) -> Optional[StoredObject]:
+        """
+        Return the document at ``key``, or None if it does not exist.
+        Raises NotModified if its version equals ``if_none_match``.
+        """
+
+    @abstractmethod
+    def put(self, key: str, data: Any, if_match: Optional[str] = None, if_none_match: bool = False) -> str:
+        """
+        Store ``data`` at ``key`` and return the new version.
+
+        With ``if_match`` the write only happens if the stored version is still
+        that one; with ``if_none_match`` only if the key does not exist yet.
+        Otherwise PreconditionFailed is raised.
+        """
+
+
+class S3Backend(StorageBackend):
+    """Documents stored as S3 objects; versions are the objects' ETags"""
+
+    def __init__(self, bucket: Optional[str] = None):
+        self.bucket = bucket or os.getenv('S3_BUCKET')
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """boto3 client, created on first use rather than at import time"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def _create_client(self):
+        import boto3
+
+        aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
+        aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+        aws_region = os.getenv('AWS_REGION', 'us-east-2')
+
+        # Print debug info
+        print(f"DEBUG - AWS Access Key: {(aws_access_key or '')[:5]}... Secret Key: {'*' * 5} Region: {aws_region} Bucket: {self.bucket}")
+
+        # Check for missing credentials
+        if not aws_access_key or not aws_secret_key:
+            print("ERROR - AWS credentials are missing!")
+
+        return boto3.client(
+            's3',
+            aws_access_key_id=aws_access_key,
+            aws_secret_access_key=aws_secret_key,
+            region_name=os.getenv('AWS_REGION'),
+            verify=True,
+            use_ssl=True,
+            config=boto3.session.Config(
+                signature_version='s3v4',
+                retries={'max_attempts': 3},
+            )
+        )
+
+    def get(self, key: str, if_none_match: Optional[str] = None) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+
+        request = {'Bucket': self.bucket, 'Key': key}
+        if if_none_match is not None:
+            request['IfNoneMatch'] = if_none_match
+        try:
+            response = self.client.get_object(**request)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        except ClientError as e:
+            if _error_code(e) in ('304', 'NotModified'):
+                raise NotModified(key)
+            raise
+        data = json.loads(response['Body'].read().decode('utf-8'))
+        return StoredObject(data, response['ETag'])
+
+    def put(self, key: str, data: Any, if_match: Optional[str] = None, if_none_match: bool = False) -> str:
+        from botocore.exceptions import ClientError
+
+        request = {'Bucket': self.bucket, 'Key': key, 'Body': json.dumps(data)}
+        if if_match is not None:
+            request['IfMatch'] = if_match
+        if if_none_match:
+            request['IfNoneMatch'] = '*'
+        try:
+            response = self.client.put_object(**request)
+        except ClientError as e:
+            if _error_code(e) in ('PreconditionFailed', '412', 'ConditionalRequestConflict', '409'):
+                raise PreconditionFailed(key)
+            raise
+        return response['ETag']
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Documents stored as rows of a local SQLite database in WAL mode.
+
+    Each key is a primary-key row, so per-user reads and writes are single
+    indexed row operations. Versions are a per-row counter.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " key TEXT PRIMARY KEY,"
+                " body TEXT NOT NULL,"
+                " version INTEGER NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; Streamlit runs each session on its own thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, if_none_match: Optional[str] = None) -> Optional[StoredObject]:
+        row = self._connection().execute(
+            "SELECT body, version FROM documents WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        etag = str(row[1])
+        if if_none_match is not None and if_none_match == etag:
+            raise NotModified(key)
+        return StoredObject(json.loads(row[0]), etag)
+
+    def put(self, key: str, data: Any, if_match: Optional[str] = None, if_none_match: bool = False) -> str:
+        body = json.dumps(data)
+        with self._connection() as conn:
+            if if_none_match:
+                try:
+                    conn.execute("INSERT INTO documents (key, body, version) VALUES (?, ?, 1)", (key, body))
+                except sqlite3.IntegrityError:
+                    raise PreconditionFailed(key)
+                return '1'
+
+            if if_match is not None:
+                cursor = conn.execute(
+                    "UPDATE documents SET body = ?, version = version + 1 WHERE key = ? AND version = ?",
+                    (body, key, int(if_match)),
+                )
+                if cursor.rowcount != 1:
+                    raise PreconditionFailed(key)
+            else:
+                conn.execute(
+                    "INSERT INTO documents (key, body, version) VALUES (?, ?, 1) "
+                    "ON CONFLICT(key) DO UPDATE SET body = excluded.body, version = version + 1",
+                    (key, body),
+                )
+            row = conn.execute("SELECT version FROM documents WHERE key = ?", (key,)).fetchone()
+            return str(row[0])
+
+
+def _error_code(error) -> str:
+    return str(error.response.get('Error', {}).get('Code', ''))
+
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """
+    Return the process-wide storage backend chosen by configuration:
+    STORAGE_BACKEND=s3 (default) or STORAGE_BACKEND=sqlite, with the database
+    file at SQLITE_STORAGE_PATH.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = os.getenv('STORAGE_BACKEND', 's3').lower()
+                if backend == 'sqlite':
+                    _backend = SQLiteBackend(os.getenv('SQLITE_STORAGE_PATH', 'nutriscan.db'))
+                elif backend == 's3':
+                    _backend = S3Backend()
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return _backend
@@ -1,21 +1,73 @@
-import google.generativeai as genai
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, Tuple
 import cv2
 import numpy as np
-from pyzbar.pyzbar import decode
-import requests
 import json
 from PIL import Image
-import pytesseract
-import re
+import time
+import uuid
 import streamlit as st
 from dotenv import load_dotenv
-from auth import get_user_profiles_from_s3, save_user_profiles_to_s3
+from auth import get_user_profile
+from barcode_decoder import confirm_barcodes, decode_all, decode_parallel
+from analysis_schema import ANALYSIS_GENERATION_CONFIG, analysis_to_reply, parse_analysis, partial_lists, partial_rating, partial_summary, render_analysis_markdown
+from dietary_rules import describe_hit, prescreen, prescreen_analysis
+from disk_cache import DiskCache
+import genai_client
+from genai_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, get_scheduler
+from image_cache import image_cache, perceptual_hash, upload_identity
+from label_regions import find_label_regions
+from ocr_pool import get_ocr_pool
+from ocr_preprocess import enhance_image, preprocess_for_ocr
+from nutrition_parser import ParsedLabel, describe_nutrient, parse_label
+from off_api import fetch_product, normalize_product
+from product_index import get_product_index
+from profile_writer import get_profile_writer, flush_profile_writes
+from single_flight import FlightAbandoned, SingleFlight
+from prompt_builder import build_prompt, compact_ingredients, estimate_tokens, token_usage
 
 # Load environment variables from .env
 load_dotenv('.env')
 
+# Open Food Facts lookups, shared across users and sessions. Unknown barcodes
+# are cached as None for a shorter time so newly added products show up.
+PRODUCT_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv('PRODUCT_CACHE_NEGATIVE_TTL_SECONDS', str(24 * 3600)))
+product_cache = DiskCache(
+    path=os.getenv('PRODUCT_CACHE_PATH', 'product_cache.db'),
+    table='products',
+    max_entries=int(os.getenv('PRODUCT_CACHE_MAX_ENTRIES', '50000')),
+    default_ttl=float(os.getenv('PRODUCT_CACHE_TTL_SECONDS', str(7 * 24 * 3600))),
+)
+
+# Gemini analyses shared between users with equivalent profiles. Bump
+# ANALYSIS_CACHE_VERSION whenever the prompt changes.
+ANALYSIS_CACHE_VERSION = 3
+analysis_cache = DiskCache(
+    path=os.getenv('ANALYSIS_CACHE_PATH', 'analysis_cache.db'),
+    table='analyses',
+    max_entries=int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '20000')),
+    default_ttl=float(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', str(3 * 24 * 3600))),
+)
+
+# Concurrent analyses of the same cache key share one Gemini call. Callers
+# wait for it as long as the leader may legitimately take: the scheduler's
+# worst-case queueing and backoff plus the generation itself.
+ANALYSIS_GENERATION_SECONDS = float(os.getenv('ANALYSIS_GENERATION_SECONDS', '60'))
+analysis_flight = SingleFlight(timeout=float(os.getenv(
+    'ANALYSIS_SINGLE_FLIGHT_TIMEOUT_SECONDS', str(get_scheduler().max_delay() + ANALYSIS_GENERATION_SECONDS))))
+
+# Analyses run at once for a multi-barcode scan (each still goes through the scheduler)
+BATCH_ANALYSIS_CONCURRENCY = int(os.getenv('BATCH_ANALYSIS_CONCURRENCY', '4'))
+
+# Badge colors per safety rating (same as the history cards in main.py)
+SAFETY_RATING_COLORS = {"Safe": "#4CAF50", "Caution": "#FF9800", "Unsafe": "#F44336"}
+
+# Concurrent lookups allowed per get_product_infos batch
+PRODUCT_LOOKUP_CONCURRENCY = int(os.getenv('PRODUCT_LOOKUP_CONCURRENCY', '8'))
+
 def create_custom_header():
     """Create a consistent header across all pages"""
     st.markdown("""
@@ -27,96 +79,76 @@ def create_custom_header():
 
 
 def init_genai():
-    """Initialize the Gemini API client"""
-    try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-    except:
-        api_key = st.secrets["api"]["GOOGLE_API_KEY"]
-
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable is not set. Please check your API key configuration.")
-
+    """Return the shared, already-configured Gemini model client"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        # Test the model with a simple prompt to ensure it's working
-        test_response = model.generate_content("Test connection")
-        if not test_response:
-            raise ValueError("Could not get a response from the API")
-        return model
+        return genai_client.get_model()
+    except ValueError:
+        raise
     except Exception as e:
         raise Exception(f"Failed to initialize Gemini API: {str(e)}")
 
-def enhance_image(image: np.ndarray) -> np.ndarray:
+def extract_nutrition_info(text: str) -> ParsedLabel:
     """
-    Enhance image quality for better OCR
+    Extract structured nutrition information from OCR text: serving size,
+    calories (kcal), ingredients, allergen statements and typed nutrient
+    records with normalized units
     """
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Noise removal
-    denoised = cv2.fastNlMeansDenoising(gray)
-
-    # Thresholding
-    thresh = cv2.threshold(denoised, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    return parse_label(text)
 
-    # Dilation
-    kernel = np.ones((1, 1), np.uint8)
-    dilated = cv2.dilate(thresh, kernel, iterations=1)
-
-    return dilated
-
-def extract_nutrition_info(text: str) -> Dict[str, str]:
+def cached_image_result(kind: str, image: np.ndarray, image_id: Optional[str], compute, verify=None):
     """
-    Extract structured nutrition information from OCR text
+    ``compute()`` for an image, through the shared perceptual-hash cache:
+    the same upload reuses the result for any user. A near-identical picture
+    from this session reuses it only if ``verify(result)`` confirms it for
+    this image; without ``verify`` only exact uploads are reused.
+    ``image_id`` identifies the upload (upload_identity of the file bytes);
+    without it the decoded pixels are hashed instead.
     """
-    info = {
-        'serving_size': '',
-        'calories': '',
-        'ingredients': '',
-        'allergens': '',
-        'nutrients': []
-    }
-
-    lines = text.split('\n')
-    current_section = None
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-
-        # Identify sections
-        lower_line = line.lower()
-        if 'serving size' in lower_line:
-            info['serving_size'] = re.sub(r'serving size[: ]*', '', line, flags=re.IGNORECASE)
-        elif 'calories' in lower_line:
-            info['calories'] = re.sub(r'calories[: ]*', '', line, flags=re.IGNORECASE)
-        elif 'ingredients' in lower_line:
-            current_section = 'ingredients'
-        elif 'contains' in lower_line and ('allergen' in lower_line or any(allergen in lower_line for allergen in ['milk', 'soy', 'nuts', 'wheat'])):
-            info['allergens'] = line
-        elif current_section == 'ingredients':
-            info['ingredients'] += ' ' + line
-        elif re.match(r'^[\d.]+ *[g|mg|%]', line):
-            info['nutrients'].append(line)
-
-    return info
-
-def process_nutrition_image(image: Image.Image) -> Optional[str]:
+    if image_id is None:
+        image_id = upload_identity(image.tobytes())
+    scope = st.session_state.setdefault('image_cache_scope', uuid.uuid4().hex)
+    phash = perceptual_hash(image)
+    found, result = image_cache.get(kind, image_id, phash, scope, verify)
+    if found:
+        return result
+    result = compute()
+    image_cache.set(kind, image_id, phash, result, scope)
+    return result
+
+def get_image_cache_stats() -> Dict:
+    """Entries, memory use, hits and misses of the decode/OCR result cache (this process)"""
+    return image_cache.stats()
+
+def ocr_label(img_cv: np.ndarray) -> str:
+    """OCR a label photo (BGR)"""
+    # OCR only the nutrition table and text blocks, each with its own page
+    # segmentation mode, in parallel on the shared worker pool (engines stay
+    # loaded between calls); fall back to the whole photo as one block
+    ocr_pool = get_ocr_pool()
+    regions = find_label_regions(img_cv)
+    if regions:
+        # Preprocessing is size- and noise-aware, and runs on the workers alongside the OCR;
+        # enhance_image is kept as the benchmark baseline
+        futures = [ocr_pool.submit(region.image, region.psm, preprocess=preprocess_for_ocr) for region in regions]
+        deadline = time.monotonic() + ocr_pool.timeout
+        try:
+            text = "\n".join(future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures)
+        finally:
+            for future in futures:
+                future.cancel()
+    else:
+        text = ocr_pool.image_to_string(img_cv, psm=6, preprocess=preprocess_for_ocr)
+    return text
+
+def process_nutrition_image(image: Image.Image, image_id: Optional[str] = None) -> Optional[str]:
     """
     Process nutrition facts image and extract text with enhanced preprocessing
     """
     try:
         # Convert PIL Image to OpenCV format
         img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-
-        # Image preprocessing pipeline
-        processed_img = enhance_image(img_cv)
-
-        # Configure OCR parameters for better accuracy
-        custom_config = r'--oem 3 --psm 6'
-        text = pytesseract.image_to_string(processed_img, config=custom_config)
+        # OCR text has no cheap check against a similar photo, so only the exact upload is reused
+        text = cached_image_result('ocr', img_cv, image_id, lambda: ocr_label(img_cv))
 
         if not text.strip():
             return None
@@ -124,174 +156,382 @@ def process_nutrition_image(image: Image.Image) -> Optional[str]:
         # Extract structured information
         nutrition_info = extract_nutrition_info(text)
 
-        # Format the information for analysis
-        formatted_text = f"""
-Nutrition Facts:
-Serving Size: {nutrition_info['serving_size']}
-Calories: {nutrition_info['calories']}
-
-Ingredients: {nutrition_info['ingredients']}
-
-Allergen Information: {nutrition_info['allergens']}
-
-Nutrient Information:
-{chr(10).join(nutrition_info['nutrients'])}
-"""
-        return formatted_text.strip()
+        # Format the information for analysis, leaving out fields the label did not show
+        lines = ["Nutrition Facts:"]
+        if nutrition_info.serving_size:
+            lines.append(f"Serving Size: {nutrition_info.serving_size}")
+        if nutrition_info.calories is not None:
+            lines.append(f"Calories: {nutrition_info.calories:g} kcal per {nutrition_info.basis}")
+        if nutrition_info.ingredients:
+            lines.append(f"Ingredients: {compact_ingredients(nutrition_info.ingredients)}")
+        if nutrition_info.allergens:
+            lines.append(f"Allergen Information: {nutrition_info.allergens}")
+        lines += [describe_nutrient(record) for record in nutrition_info.nutrients]
+        return "\n".join(lines)
     except Exception as e:
         raise Exception(f"Failed to process image: {str(e)}")
 
-def scan_barcode(image: np.ndarray) -> Optional[str]:
+def scan_barcode(image: np.ndarray, image_id: Optional[str] = None) -> Optional[str]:
     """
     Scan barcode from image and return the barcode number
     """
     try:
-        # Convert image to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        # Decode barcodes
-        barcodes = decode(gray)
+        # Cheap downscaled pass first; if it finds nothing, region crops and
+        # preprocessing variants are tried in parallel until the deadline
+        barcodes = cached_image_result('barcode', image, image_id, lambda: decode_parallel(image),
+                                       verify=lambda cached: confirm_barcodes(image, cached))
 
         # Return the first barcode found
         if barcodes:
-            barcode = barcodes[0].data.decode('utf-8')
-            return barcode
+            return barcodes[0]
         return None
     except Exception as e:
         raise Exception(f"Failed to scan barcode: {str(e)}")
 
+def scan_barcodes(image: np.ndarray, image_id: Optional[str] = None) -> List[str]:
+    """
+    Scan every barcode in an image (a shelf or a cart) and return them in
+    detection order
+    """
+    try:
+        return cached_image_result('barcodes', image, image_id, lambda: decode_all(image),
+                                   verify=lambda cached: confirm_barcodes(image, cached))
+    except Exception as e:
+        raise Exception(f"Failed to scan barcodes: {str(e)}")
+
 def get_product_info(barcode: str) -> Optional[Dict]:
     """
     Retrieve product information from Open Food Facts API
     """
     print('DEBUG - Getting product info for barcode:', barcode)
+    # Local Open Food Facts index (import_off_dump.py), if one is configured
+    product_index = get_product_index()
+    if product_index is not None:
+        try:
+            indexed_info = product_index.get(barcode)
+            if indexed_info is not None:
+                return indexed_info
+        except Exception as e:
+            print(f"DEBUG - Product index lookup failed: {str(e)}")
+
+    try:
+        found, cached_info = product_cache.get(barcode)
+        if found:
+            return cached_info
+    except Exception as e:
+        print(f"DEBUG - Product cache unavailable: {str(e)}")
+
     try:
         # Make API request to Open Food Facts
-        url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
-        response = requests.get(url)
-        data = response.json()
+        product = fetch_product(barcode)
 
-        if data.get('status') != 1:
+        if product is None:
+            _cache_product(barcode, None, ttl=PRODUCT_CACHE_NEGATIVE_TTL_SECONDS)
             return None
 
-        product = data['product']
-
         # Extract relevant information
-        nutrition_info = {
-            'product_name': product.get('product_name', 'Unknown Product'),
-            'serving_size': product.get('serving_size', 'Not specified'),
-            'calories': product.get('nutriments', {}).get('energy-kcal_100g', 'Not specified'),
-            'ingredients': product.get('ingredients_text', ''),
-            'allergens': product.get('allergens_hierarchy', []),
-            'nutrients': {
-                'fat': product.get('nutriments', {}).get('fat_100g', 'Not specified'),
-                'proteins': product.get('nutriments', {}).get('proteins_100g', 'Not specified'),
-                'carbohydrates': product.get('nutriments', {}).get('carbohydrates_100g', 'Not specified'),
-                'sugars': product.get('nutriments', {}).get('sugars_100g', 'Not specified'),
-                'fiber': product.get('nutriments', {}).get('fiber_100g', 'Not specified'),
-                'sodium': product.get('nutriments', {}).get('sodium_100g', 'Not specified')
-            }
-        }
+        nutrition_info = normalize_product(product)
 
+        _cache_product(barcode, nutrition_info)
         return nutrition_info
     except Exception as e:
         print('DEBUG - failed to retrieve product information')
         raise Exception(f"Failed to retrieve product information: {str(e)}")
 
+async def get_product_infos(barcodes: List[str], max_concurrency: int = PRODUCT_LOOKUP_CONCURRENCY) -> Dict[str, Optional[Dict]]:
+    """
+    Look up several barcodes concurrently.
+
+    Repeated barcodes are looked up once, at most ``max_concurrency`` lookups
+    run at a time, and each result is the same dict get_product_info returns.
+    A barcode that is unknown or whose lookup failed maps to None without
+    affecting the others.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def lookup(barcode: str) -> Optional[Dict]:
+        async with semaphore:
+            try:
+                # get_product_info blocks on the index, cache and HTTP pool; run it off the loop
+                return await asyncio.to_thread(get_product_info, barcode)
+            except Exception as e:
+                print(f"DEBUG - Lookup failed for barcode {barcode}: {str(e)}")
+                return None
+
+    unique_barcodes = list(dict.fromkeys(barcodes))
+    results = await asyncio.gather(*(lookup(barcode) for barcode in unique_barcodes))
+    return dict(zip(unique_barcodes, results))
+
+def get_product_infos_blocking(barcodes: List[str], max_concurrency: int = PRODUCT_LOOKUP_CONCURRENCY) -> Dict[str, Optional[Dict]]:
+    """Run get_product_infos from synchronous code such as the Streamlit script"""
+    return asyncio.run(get_product_infos(barcodes, max_concurrency))
+
+def _cache_product(barcode: str, nutrition_info: Optional[Dict], ttl: Optional[float] = None) -> None:
+    """Store a lookup result in the shared product cache; a cache failure never fails the lookup"""
+    try:
+        product_cache.set(barcode, nutrition_info, ttl=ttl)
+    except Exception as e:
+        print(f"DEBUG - Failed to cache product {barcode}: {str(e)}")
+
 def format_nutrition_info(info: Dict) -> str:
     """
-    Format nutrition information for analysis
+    Format nutrition information for analysis. Values that are not specified
+    are left out and the ingredient list is compacted to its token budget.
     """
     nutrients_text = "\n".join([
-        f"{key.capitalize()}: {value}g per 100g"
+        f"{key.capitalize()}: {value}g"
         for key, value in info['nutrients'].items()
-        if value != 'Not specified'
+        if value not in (None, '', 'Not specified')
     ])
 
     allergens_text = ", ".join([
         allergen.replace('en:', '') for allergen in info['allergens']
     ]) or "None listed"
 
-    formatted_text = f"""
-Nutrition Facts for {info['product_name']}:
-Serving Size: {info['serving_size']}
-Calories: {info['calories']} kcal per 100g
-
-Ingredients: {info['ingredients']}
+    lines = [f"Product: {info['product_name']}"]
+    # Missing fields are 'Not specified' or empty (normalize_product defaults ingredients to '')
+    if info.get('serving_size') and info['serving_size'] != 'Not specified':
+        lines.append(f"Serving Size: {info['serving_size']}")
+    if info.get('calories') not in (None, '', 'Not specified'):
+        lines.append(f"Calories: {info['calories']} kcal per 100g")
+    if info.get('ingredients') and info['ingredients'] != 'Not specified':
+        lines.append(f"Ingredients: {compact_ingredients(info['ingredients'])}")
+    lines.append(f"Allergens: {allergens_text}")
+    if nutrients_text:
+        lines.append(f"Per 100g:\n{nutrients_text}")
+
+    return "\n".join(lines)
+
+def build_analysis_prompt(user_profile: Dict, nutrition_info: str, prescreen_hits: Optional[List[Dict]] = None) -> Tuple[str, str]:
+    """
+    Build the analysis prompt and its cache key.
 
-Allergen Information: {allergens_text}
+    Users with the same normalized profile get the same prompt, so the result
+    can be shared through the analysis cache. Rule hits from the pre-screen
+    are passed on to the model for it to confirm or dismiss.
+    """
+    fingerprint = profile_fingerprint(user_profile)
+    cache_key = analysis_cache_key(fingerprint, nutrition_info, prescreen_hits)
+    prescreen_text = ""
+    if prescreen_hits:
+        prescreen_text = "\nPRE-SCREEN (automatic ingredient matches, confirm or dismiss):\n" + \
+            "\n".join(f"- {describe_hit(hit)}" for hit in prescreen_hits) + "\n"
+
+    prompt = build_prompt({
+        'age_band': fingerprint['age_band'],
+        'health_conditions': ', '.join(fingerprint['health_conditions']) or 'None reported',
+        'allergies': ', '.join(fingerprint['allergies']) or 'None reported',
+        'dietary_restrictions': ', '.join(fingerprint['dietary_restrictions']) or 'None',
+        'prescreen_text': prescreen_text,
+    }, nutrition_info)
+    return cache_key, prompt
+
+def _get_cached_analysis(cache_key: str) -> Optional[Dict]:
+    try:
+        found, cached_analysis = analysis_cache.get(cache_key)
+        return cached_analysis if found else None
+    except Exception as e:
+        print(f"DEBUG - Analysis cache unavailable: {str(e)}")
+        return None
 
-Nutrient Information per 100g:
-{nutrients_text}
-"""
+def _cache_analysis(cache_key: str, analysis: Dict) -> None:
+    try:
+        analysis_cache.set(cache_key, analysis)
+    except Exception as e:
+        print(f"DEBUG - Failed to cache analysis: {str(e)}")
 
-    return formatted_text.strip()
+def run_prescreen(user_profile: Dict, product_info: Optional[Dict]) -> Optional[Dict]:
+    """Deterministic allergen/dietary pre-screen of a product, or None without product data"""
+    if not product_info:
+        return None
+    fingerprint = profile_fingerprint(user_profile)
+    return prescreen(product_info, fingerprint['allergies'], fingerprint['dietary_restrictions'])
 
-def analyze_ingredients(model, user_profile: Dict, nutrition_info: str) -> Dict:
+def analyze_ingredients(model, user_profile: Dict, nutrition_info: str, product_info: Optional[Dict] = None,
+                        priority: int = PRIORITY_INTERACTIVE) -> Dict:
     """
-    Analyze ingredients using Gemini API based on user profile
+    Analyze ingredients using Gemini API based on user profile.
+
+    With ``product_info`` the product is pre-screened first: a clear conflict
+    with the user's allergies or dietary restrictions is answered locally
+    without calling the model. Model calls go through the shared scheduler
+    at ``priority`` (background work should pass PRIORITY_BACKGROUND).
     """
     try:
-        # Format health conditions and allergies for better readability
-        health_conditions = user_profile.get('health_conditions', '').strip() or 'None reported'
-        allergies = user_profile.get('allergies', '').strip() or 'None reported'
-        dietary_restrictions = ', '.join(user_profile.get('dietary_restrictions', ['None']))
+        screen = run_prescreen(user_profile, product_info)
+        if screen and screen['verdict'] == 'unsafe':
+            return {
+                'success': True,
+                'analysis': prescreen_analysis(product_info, screen),
+                'prescreened': True
+            }
 
-        prompt = f"""
-As a nutrition and dietary safety expert, analyze this nutrition label for a person with the following profile:
+        cache_key, prompt = build_analysis_prompt(user_profile, nutrition_info, screen and screen['hits'])
+        cached_analysis = _get_cached_analysis(cache_key)
+        if cached_analysis is not None:
+            return {
+                'success': True,
+                'analysis': cached_analysis,
+                'cached': True
+            }
 
-USER PROFILE:
-- Age: {user_profile['age']} years
-- Health Conditions: {health_conditions}
-- Allergies: {allergies}
-- Dietary Restrictions: {dietary_restrictions}
+        analysis = analysis_flight.do(cache_key, lambda: _generate_analysis(model, cache_key, prompt, priority))
+        return {
+            'success': True,
+            'analysis': analysis
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f"Analysis failed: {str(e)}"
+        }
 
-NUTRITION INFORMATION:
-{nutrition_info}
+def _generate_analysis(model, cache_key: str, prompt: str, priority: int) -> Dict:
+    started = time.monotonic()
+    response = get_scheduler().call(
+        lambda: model.generate_content(prompt, generation_config=ANALYSIS_GENERATION_CONFIG), priority)
+    token_usage.record(response.usage_metadata, time.monotonic() - started, estimate_tokens(prompt))
+    analysis = parse_analysis(response.text)
+    _cache_analysis(cache_key, analysis)
+    return analysis
+
+def analyze_ingredients_stream(model, user_profile: Dict, nutrition_info: str, product_info: Optional[Dict] = None,
+                               priority: int = PRIORITY_INTERACTIVE) -> Iterator[str]:
+    """
+    Streaming variant of analyze_ingredients: yields the raw JSON reply chunk
+    by chunk as the model produces it (a cached or pre-screened analysis comes
+    as one chunk). Pass the joined text to parse_analysis. Errors are raised
+    rather than returned.
 
-Please provide a comprehensive analysis in the following format. Emphasize readability and clarity for the user, utilizing formatting tricks like bullet points and varied text styles:
+    A caller that finds the same analysis already being generated waits for
+    it and receives it as one chunk.
+    """
+    screen = run_prescreen(user_profile, product_info)
+    if screen and screen['verdict'] == 'unsafe':
+        yield analysis_to_reply(prescreen_analysis(product_info, screen))
+        return
+
+    cache_key, prompt = build_analysis_prompt(user_profile, nutrition_info, screen and screen['hits'])
+    cached_analysis = _get_cached_analysis(cache_key)
+    if cached_analysis is not None:
+        yield analysis_to_reply(cached_analysis)
+        return
+
+    while True:
+        is_leader, flight = analysis_flight.acquire(cache_key)
+        if is_leader:
+            break
+        try:
+            shared = analysis_flight.wait(flight)
+        except FlightAbandoned:
+            continue
+        except TimeoutError:
+            print(f"DEBUG - Timed out waiting for in-flight analysis {cache_key[:12]}, generating it here")
+            break
+        yield analysis_to_reply(shared)
+        return
 
-SAFETY ASSESSMENT:
-[Provide an overall safety rating (Safe/Caution/Unsafe) and brief explanation]
+    analysis = None
+    try:
+        chunks = []
+        started = time.monotonic()
+        # The first chunk is fetched inside generate_content, so quota errors are retried by the scheduler
+        response = get_scheduler().call(
+            lambda: model.generate_content(prompt, generation_config=ANALYSIS_GENERATION_CONFIG, stream=True), priority)
+        for chunk in response:
+            chunks.append(chunk.text)
+            yield chunk.text
+        # usage_metadata is filled in once the stream has been consumed
+        token_usage.record(response.usage_metadata, time.monotonic() - started, estimate_tokens(prompt))
+        analysis = parse_analysis(''.join(chunks))
+        _cache_analysis(cache_key, analysis)
+    finally:
+        # A failed or closed stream leaves the followers to retry rather than see its exception
+        if is_leader and analysis is not None:
+            analysis_flight.release(cache_key, flight, analysis)
+        elif is_leader:
+            analysis_flight.abandon(cache_key, flight)
+
+def analyze_products(model, user_profile: Dict, barcodes: List[str],
+                     max_concurrency: int = BATCH_ANALYSIS_CONCURRENCY,
+                     priority: int = PRIORITY_BACKGROUND) -> List[Dict]:
+    """
+    Look up and analyze several products at once. Lookups run concurrently
+    (get_product_infos), then up to ``max_concurrency`` analyses, queued at
+    background ``priority`` so a batch does not hold up single scans. Returns one
+    ``{'barcode', 'product', 'result'}`` per barcode, in order; ``product`` is
+    None for unknown barcodes and ``result`` is what analyze_ingredients returns.
+    """
+    products = get_product_infos_blocking(barcodes)
+
+    def analyze(barcode: str) -> Dict:
+        product = products.get(barcode)
+        if product is None:
+            return {'barcode': barcode, 'product': None,
+                    'result': {'success': False, 'error': "Product not found in database"}}
+        product = dict(product, barcode=barcode)
+        result = analyze_ingredients(model, user_profile, format_nutrition_info(product), product, priority)
+        return {'barcode': barcode, 'product': product, 'result': result}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        return list(pool.map(analyze, list(dict.fromkeys(barcodes))))
+
+def render_safety_badge(rating: str) -> str:
+    """HTML badge for a safety rating, in the colors used by the history cards"""
+    color = SAFETY_RATING_COLORS.get(rating, "#9E9E9E")
+    return f"""
+    <div style="margin-bottom: 10px;">
+        <span style="background-color: {color}; color: white; padding: 4px 10px; border-radius: 10px; font-weight: bold;">
+            {rating}
+        </span>
+    </div>
+    """
 
-FURTHER ANALYSIS -- each should be brief with detail only if important as a warning to the user given their health profile:
-1. Allergen Risk:
-   - Known allergens present
-   - Cross-contamination risks
-   - Severity level for user's specific allergies
+def _normalize_terms(value) -> List[str]:
+    """Comma-separated text or a list of terms -> sorted, de-duplicated, lowercase terms"""
+    if isinstance(value, str):
+        value = value.split(',')
+    terms = {term.strip().lower() for term in value or [] if term and term.strip()}
+    terms.discard('none')
+    return sorted(terms)
 
-2. Dietary Compliance:
-   - Compatibility with dietary restrictions
-   - Any conflicting ingredients
+def profile_fingerprint(user_profile: Dict) -> Dict:
+    """
+    The profile fields used in the analysis prompt, normalized: age as a
+    ten-year band, and conditions, allergies and restrictions as sorted
+    lowercase term lists
+    """
+    age = int(user_profile.get('age', 0) or 0)
+    band_start = age // 10 * 10
+    return {
+        'age_band': f"{band_start}-{band_start + 9}",
+        'health_conditions': _normalize_terms(user_profile.get('health_conditions', '')),
+        'allergies': _normalize_terms(user_profile.get('allergies', '')),
+        'dietary_restrictions': _normalize_terms(user_profile.get('dietary_restrictions', [])),
+    }
 
-3. Nutritional Impact:
-   - Key nutrients and their relevance to user's health conditions
-   - Portion size considerations
-   - Caloric and macro-nutrient assessment
+def analysis_cache_key(fingerprint: Dict, nutrition_info: str, prescreen_hits: Optional[List[Dict]] = None) -> str:
+    """Content address of an analysis: profile fingerprint + hash of the formatted nutrition info (+ pre-screen hits)"""
+    nutrition_hash = hashlib.sha256(nutrition_info.encode('utf-8')).hexdigest()
+    payload = json.dumps({'v': ANALYSIS_CACHE_VERSION, 'profile': fingerprint, 'nutrition': nutrition_hash,
+                          'prescreen': prescreen_hits or []}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
-4. Health Considerations:
-   - Specific impacts on user's health conditions
-   - Potential interactions with medications (if any)
-   - Long-term consumption considerations
+def get_analysis_cache_stats() -> Dict:
+    """Hits, misses, evictions and hit rate of the shared analysis cache (this process)"""
+    return analysis_cache.stats()
 
-RECOMMENDATIONS:
-- Specific advice for safe consumption
-- Suggested alternatives (if needed)
-- Portion size recommendations
+def get_analysis_flight_stats() -> Dict:
+    """Leaders, coalesced followers, follower timeouts and in-flight analyses (this process)"""
+    return analysis_flight.stats()
 
-Please prioritize accuracy and be specific about any health risks or concerns. If a food is safe but not extremely healthy (like chocolate), it is still considered safe.
-"""
+def get_genai_scheduler_metrics() -> Dict:
+    """Queue depth, wait times, rejections and retries of Gemini requests (this process)"""
+    return get_scheduler().metrics()
 
-        response = model.generate_content(prompt)
-        return {
-            'success': True,
-            'analysis': response.text
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'error': f"Analysis failed: {str(e)}"
-        }
+def get_token_usage_stats() -> Dict:
+    """Input/output tokens and latency of recent Gemini calls (this process), with latency by prompt size"""
+    return token_usage.stats()
 
 def validate_user_input(data: Dict) -> tuple[bool, str]:
     """Validate user input data"""
@@ -324,83 +564,30 @@ def save_product_to_history(username, product_info, analysis_results):
     try:
         print(f"DEBUG - Saving product to history: {product_info.get('product_name')}")
 
-        # Get current user's product history
-        profiles = get_user_profiles_from_s3()
-        user_profile = profiles.get(username, {})
-        
-        # Initialize product history if it doesn't exist
-        if 'product_history' not in user_profile:
-            user_profile['product_history'] = []
-
-        # Get barcode for comparison
+        # Create new history entry
+        from datetime import datetime
         barcode = product_info.get('barcode', '')
-        print(f"DEBUG - Looking for existing product with barcode: {barcode}")
-        
-        # Track if we found and replaced an existing product
-        replaced = False
-
-        # Look for existing product with same barcode and replace it
-        if barcode:
-            for i, product in enumerate(user_profile['product_history']):
-                if product.get('barcode') == barcode:
-                    print(f"DEBUG - Found existing product at index {i}, replacing it")
-                    
-                    # Create new history entry
-                    from datetime import datetime
-                    product_entry = {
-                        'product_id': product_info.get('id', ''),
-                        'barcode': barcode,
-                        'product_name': product_info.get('product_name', 'Unknown Product'),
-                        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'analysis_summary': extract_analysis_summary(analysis_results),
-                        'safety_rating': extract_safety_rating(analysis_results),
-                        'full_analysis': analysis_results,
-                        'nutrition_info': {
-                            'serving_size': product_info.get('serving_size', 'Not specified'),
-                            'calories': product_info.get('calories', 'Not specified'),
-                            'nutrients': product_info.get('nutrients', {})
-                        }
-                    }
-                    
-                    # Replace the existing entry
-                    user_profile['product_history'][i] = product_entry
-                    replaced = True
-                    break
-
-
-        # If we didn't replace an existing entry, add as new
-        if not replaced:
-            print(f"DEBUG - No existing product found, adding as new entry")
-            
-            # Create new history entry
-            from datetime import datetime
-            product_entry = {
-                'product_id': product_info.get('id', ''),
-                'barcode': barcode,
-                'product_name': product_info.get('product_name', 'Unknown Product'),
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'analysis_summary': extract_analysis_summary(analysis_results),
-                'safety_rating': extract_safety_rating(analysis_results),
-                'full_analysis': analysis_results,
-                'nutrition_info': {
-                    'serving_size': product_info.get('serving_size', 'Not specified'),
-                    'calories': product_info.get('calories', 'Not specified'),
-                    'nutrients': product_info.get('nutrients', {})
-                }
+        product_entry = {
+            'product_id': product_info.get('id', ''),
+            'barcode': barcode,
+            'product_name': product_info.get('product_name', 'Unknown Product'),
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'analysis_summary': extract_analysis_summary(analysis_results),
+            'safety_rating': extract_safety_rating(analysis_results),
+            'analysis': analysis_results,
+            'nutrition_info': {
+                'serving_size': product_info.get('serving_size', 'Not specified'),
+                'calories': product_info.get('calories', 'Not specified'),
+                'nutrients': product_info.get('nutrients', {})
             }
-            
-            # Add to the beginning of history
-            user_profile['product_history'].insert(0, product_entry)
-            
-            # Keep only the most recent 20 products
-            if len(user_profile['product_history']) > 20:
-                user_profile['product_history'] = user_profile['product_history'][:20]
-        
-        # Save updated profile
-        profiles[username] = user_profile
-        save_result = save_user_profiles_to_s3(profiles)
-        print(f"DEBUG - Save result: {save_result}")
-        
+        }
+
+        # Applied to the latest stored profile when the session's writes are flushed
+        def add_entry(user_profile):
+            add_history_entry(user_profile, product_entry)
+
+        get_profile_writer(username).stage(add_entry)
+
         return True
     except Exception as e:
         print(f"DEBUG - Error saving product to history: {str(e)}")
@@ -408,11 +595,29 @@ def save_product_to_history(username, product_info, analysis_results):
         return False
 
 
+def add_history_entry(user_profile, product_entry):
+    """Insert or replace a product entry in a profile's history, in place"""
+    # Initialize product history if it doesn't exist
+    if 'product_history' not in user_profile:
+        user_profile['product_history'] = []
+
+    # Look for existing product with same barcode and replace it
+    barcode = product_entry.get('barcode')
+    if barcode:
+        for i, product in enumerate(user_profile['product_history']):
+            if product.get('barcode') == barcode:
+                user_profile['product_history'][i] = product_entry
+                return
+
+    # Add to the beginning of history, keeping only the most recent 20 products
+    user_profile['product_history'].insert(0, product_entry)
+    del user_profile['product_history'][20:]
+
+
 def get_product_history(username):
     """Get user's product scan history"""
     try:
-        profiles = get_user_profiles_from_s3()
-        user_profile = profiles.get(username, {})
+        user_profile = get_user_profile(username)
         return user_profile.get('product_history', [])
     except Exception as e:
         st.error(f"Failed to retrieve product history: {str(e)}")
@@ -432,47 +637,36 @@ def get_product_from_history(username, barcode):
         st.error(f"Error checking product history: {str(e)}")
         return None
 
+def get_history_analysis(product):
+    """Analysis of a history entry: the typed dict, or the free text stored by older entries"""
+    return product.get('analysis') or product.get('full_analysis')
+
 def extract_safety_rating(analysis):
-    """Extract safety rating from analysis text"""
+    """Extract safety rating from an analysis (typed dict, or legacy free text)"""
+    if isinstance(analysis, dict):
+        return analysis.get('rating', 'Unknown')
     try:
         if "SAFETY ASSESSMENT:" in analysis:
-            # safety_section = analysis.split("SAFETY ASSESSMENT:")[1].split("\n")[0].strip()
             safety_text = analysis.split("SAFETY ASSESSMENT:")[1]
-            lines = safety_text.split("\n")
-            print(f"Debug - First 3 lines after split: {lines[:3]}")
-            # Check the next few lines for safety indicators
-            lines = safety_text.split("\n")
-            print(f"Debug - First 3 lines after split: {lines[:3]}")
-            
-            # Check the first few non-empty lines
-            for line in lines[:3]:
+            # Check the first few non-empty lines for rating keywords
+            for line in safety_text.split("\n")[:3]:
                 line = line.strip()
-                if not line:  # Skip empty lines
+                if not line:
                     continue
-                    
-                print(f"Debug - Checking line: '{line}'")
-                # Look for rating keywords in this line
                 if "Safe" in line or "safe" in line:
-                    print(f"Debug - Found 'Safe' in: '{line}'")
                     return "Safe"
                 elif "Caution" in line or "caution" in line or "Moderate" in line:
-                    print(f"Debug - Found 'Caution' in: '{line}'")
                     return "Caution"
                 elif "Unsafe" in line or "unsafe" in line or "Avoid" in line:
-                    print(f"Debug - Found 'Unsafe' in: '{line}'")
                     return "Unsafe"
-                
-            # If we get here, no rating was found in the first few lines
-            print(f"Debug - No rating found in first few lines")
-        else:
-            print(f"Debug - 'SAFETY ASSESSMENT:' not found in text")
         return "Unknown"
-    except Exception as e:
-        print(f"Debug - Error in extract_safety_rating: {str(e)}")
+    except Exception:
         return "Unknown"
 
 def extract_analysis_summary(analysis):
-    """Extract a brief summary from the full analysis"""
+    """Extract a brief summary from an analysis (typed dict, or legacy free text)"""
+    if isinstance(analysis, dict):
+        return analysis.get('summary') or "No summary available"
     try:
         if "SAFETY ASSESSMENT:" in analysis:
             # Get the first paragraph after SAFETY ASSESSMENT
@@ -494,7 +688,7 @@ def check_product_history_before_api(barcode, username):
     historical_product = get_product_from_history(username, barcode)
 
     if historical_product:
-        analysis = historical_product.get('full_analysis')
+        analysis = get_history_analysis(historical_product)
 
         return {
             'from_history': True,
@@ -576,8 +770,7 @@ def run_analyze(barcode):
     formatted_info = format_nutrition_info(st.session_state.current_product)
     
     with st.spinner("Analyzing nutritional information..."):
-        model = init_genai()
-        analysis_result = analyze_ingredients(model, st.session_state.user_data, formatted_info)
+        analysis_result = stream_analysis(formatted_info)
         
         if analysis_result['success']:
             # Save results to history
@@ -588,6 +781,7 @@ def run_analyze(barcode):
                     st.session_state.current_product, 
                     analysis_result['analysis']
                 )
+                flush_profile_writes(username)
 
             st.session_state.analysis_results = analysis_result['analysis']
             st.session_state.analysis_success = analysis_result['success']
@@ -603,6 +797,96 @@ def run_analyze(barcode):
 
 
 
+def run_batch_analyze(barcodes):
+    """
+    Analyze every product from a multi-barcode scan, save each analyzed
+    product to history and show the combined verdicts
+    """
+    with st.spinner(f"Analyzing {len(barcodes)} products..."):
+        try:
+            batch_results = analyze_products(init_genai(), st.session_state.user_data, barcodes)
+        except Exception as e:
+            st.error(f"Analysis failed: {str(e)}")
+            return
+
+    username = st.session_state.get('username')
+    if username:
+        for item in batch_results:
+            if item['result']['success']:
+                save_product_to_history(username, item['product'], item['result']['analysis'])
+        flush_profile_writes(username)
+
+    st.session_state.batch_results = batch_results
+    st.session_state.step = 'batch_results'
+    st.rerun()
+
+def render_batch_verdicts(batch_results):
+    """Verdict table for a multi-barcode scan, with each product's full analysis below it"""
+    rows = ["| Product | Barcode | Rating | Summary |", "|---|---|---|---|"]
+    for item in batch_results:
+        product_name = (item['product'] or {}).get('product_name') or 'Unknown Product'
+        if item['result']['success']:
+            analysis = item['result']['analysis']
+            color = SAFETY_RATING_COLORS.get(analysis['rating'], "#9E9E9E")
+            rating = f'<span style="color: {color}; font-weight: bold;">{analysis["rating"]}</span>'
+            summary = analysis['summary']
+        else:
+            rating, summary = "—", item['result']['error']
+        summary = summary.replace('|', '/').replace('\n', ' ')
+        rows.append(f"| {product_name.replace('|', '/')} | {item['barcode']} | {rating} | {summary} |")
+    st.markdown("\n".join(rows), unsafe_allow_html=True)
+
+    for item in batch_results:
+        if item['result']['success']:
+            with st.expander(f"{item['product'].get('product_name') or 'Unknown Product'} ({item['barcode']})"):
+                st.markdown(render_analysis_markdown(item['result']['analysis']))
+
+def stream_analysis(formatted_info):
+    """
+    Run the analysis in streaming mode. The safety rating is rendered as soon
+    as it arrives and the summary once it is complete; after that the
+    findings and recommendations fill in item by item as they arrive.
+    Returns the same dict as analyze_ingredients.
+    """
+    rating_placeholder = st.empty()
+    summary_placeholder = st.empty()
+    details_placeholder = st.empty()
+    reply = ''
+    rating = summary = lists = None
+    try:
+        model = init_genai()
+        for chunk in analyze_ingredients_stream(model, st.session_state.user_data, formatted_info, st.session_state.current_product):
+            reply += chunk
+            if rating is None:
+                rating = partial_rating(reply)
+                if rating is not None:
+                    rating_placeholder.markdown(render_safety_badge(rating), unsafe_allow_html=True)
+            if summary is None:
+                summary = partial_summary(reply)
+                if summary is not None:
+                    summary_placeholder.markdown(summary)
+                    details_placeholder.caption("Preparing detailed findings...")
+            if summary is not None:
+                received = partial_lists(reply)
+                if received != lists and (any(received['findings'].values()) or received['recommendations']):
+                    lists = received
+                    details_placeholder.markdown(render_analysis_markdown(
+                        dict(received, rating=rating or 'Unknown', summary=summary)))
+
+        analysis = parse_analysis(reply)
+        details_placeholder.markdown(render_analysis_markdown(analysis))
+        return {
+            'success': True,
+            'analysis': analysis
+        }
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f"Analysis failed: {str(e)}"
+        }
+
+
+
 def handle_barcode(barcode):
     get_barcode_next_steps(barcode)
     if st.session_state.barcode_scanned: